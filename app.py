@@ -1,55 +1,68 @@
 import streamlit as st
-import requests
-import base64
-from PIL import Image, ImageDraw
-import io
-from streamlit_drawable_canvas import st_canvas
-import numpy as np
-from const import LEONARDO_API_KEY
+from change_detect import has_visual_change, raster_fingerprint
+from executors import submit_encode
+from history import render_history
+from lcm_engine import (background_image, display_generation, fragment, generate_lcm_image, render_engine_status,
+                        rerun, st_canvas)
+from metrics import start_metrics_server
+from profiling import profiled
+from scheduler import get_scheduler
+from session_memory import account_session
 
-def encode_image(image):
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-@st.cache_data
-def generate_lcm_image(image_data, prompt, width, height, style="CINEMATIC", strength=0.65):
-    url = "https://cloud.leonardo.ai/api/rest/v1/generations-lcm"
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": f"Bearer {LEONARDO_API_KEY}"
-    }
-    payload = {
-        "width": width,
-        "height": height,
-        "imageDataUrl": f"data:image/jpeg;base64,{image_data}",
-        "prompt": prompt,
-        "style": style,
-        "strength": strength
-    }
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        result = response.json()
-        return result['lcmGenerationJob']['imageDataUrl'][0]
-    except requests.exceptions.Timeout:
-        st.error("The request to the API timed out. Please try again later.")
-    except requests.exceptions.ConnectionError as e:
-        st.error(f"A connection error occurred: {e}")
-    except requests.exceptions.RequestException as e:
-        st.error(f"An error occurred while making the request: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            st.error(f"Response status code: {e.response.status_code}")
-            st.error(f"Response content: {e.response.text}")
-    except KeyError:
-        st.error("Unexpected response format from the API.")
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
-    return None
+@fragment
+@profiled(refresh=True)
+def canvas_and_generation(width, height, bg_color, stroke_width, stroke_color, drawing_mode,
+                          prompt, style, strength, progressive):
+    # Штрих перезапускает только этот фрагмент, а не всю страницу
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Drawing Canvas")
+        
+        # Создаем базовое изображение
+        bg_image = background_image(width, height, bg_color)
+        
+        canvas_result = st_canvas(
+            fill_color="rgba(255, 165, 0, 0.3)",
+            stroke_width=stroke_width,
+            stroke_color=stroke_color,
+            background_image=bg_image,
+            height=height,
+            width=width,
+            drawing_mode=drawing_mode,
+            key=f"canvas_{st.session_state.get('canvas_key', 0)}",
+            update_streamlit=True,  # Add this line
+        )
+    
+    with col2:
+        st.subheader("Generated Image")
+        image_placeholder = st.empty()
+        status_placeholder = st.empty()
+        history_container = st.container()
+
+    scheduler = get_scheduler(generate_lcm_image, progressive=progressive)
+
+    # Отслеживаем изменения на холсте
+    if canvas_result.image_data is not None:
+        # Проверяем, заметно ли изменился холст
+        current_fingerprint = raster_fingerprint(canvas_result.image_data, bg_color)
+        if has_visual_change(st.session_state.get('last_canvas_fingerprint'), current_fingerprint):
+            st.session_state.last_canvas_fingerprint = current_fingerprint
+            
+            img_data = submit_encode(canvas_result.image_data, bg_color)
+            snapshot = (img_data, prompt, width, height, style, strength)
+            scheduler.submit(snapshot)
+
+    # Показываем последний результат, пока ждём более свежий
+    display_generation(scheduler, image_placeholder, status_placeholder, width)
+    render_history(history_container, image_placeholder, width)
+    account_session()
+
 
 def main():
     st.set_page_config(layout="wide", page_title="Leonardo AI Image Generator")
+    start_metrics_server()
     
     st.title("Leonardo AI LCM Image Generation")
 
@@ -74,10 +87,13 @@ def main():
         prompt = st.text_input("Enter your prompt:", "")
         style = st.selectbox("Choose style:", ["CINEMATIC", "DYNAMIC", "CREATIVE"])
         strength = st.slider("Creativity Strength:", 0.0, 1.0, 0.65)
+        progressive = st.checkbox("Progressive preview", help="Show a quick low-resolution result first, then refine at full size")
 
         if st.button('Clear Canvas'):
             st.session_state.canvas_key = st.session_state.get('canvas_key', 0) + 1
-            st.experimental_rerun()
+            rerun()
+
+        render_engine_status()
 
     # CSS для фиксации размеров холста и изображения
     st.markdown(f"""
@@ -94,52 +110,8 @@ def main():
         </style>
     """, unsafe_allow_html=True)
     
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Drawing Canvas")
-        
-        # Создаем базовое изображение
-        bg_image = Image.new('RGB', (width, height), color=bg_color)
-        
-        # Преобразуем изображение в массив numpy для st_canvas
-        img_array = np.array(bg_image)
-        
-        canvas_result = st_canvas(
-            fill_color="rgba(255, 165, 0, 0.3)",
-            stroke_width=stroke_width,
-            stroke_color=stroke_color,
-            background_image=Image.fromarray(img_array.astype('uint8')),
-            height=height,
-            width=width,
-            drawing_mode=drawing_mode,
-            key=f"canvas_{st.session_state.get('canvas_key', 0)}",
-            update_streamlit=True,  # Add this line
-        )
-    
-    with col2:
-        st.subheader("Generated Image")
-        image_placeholder = st.empty()
-
-    # Отслеживаем изменения на холсте
-    if canvas_result.image_data is not None and canvas_result.json_data is not None:
-        # Проверяем, изменился ли холст
-        current_canvas_state = canvas_result.json_data
-        if 'last_canvas_state' not in st.session_state or st.session_state.last_canvas_state != current_canvas_state:
-            st.session_state.last_canvas_state = current_canvas_state
-            
-            img = Image.fromarray(canvas_result.image_data.astype('uint8'), 'RGBA')
-            img = img.convert('RGB')
-            img_data = encode_image(img)
-            
-            with st.spinner("Generating image..."):
-                result = generate_lcm_image(img_data, prompt, width, height, style, strength)
-                
-                if result:
-                    generated_image = Image.open(io.BytesIO(base64.b64decode(result.split(',')[1])))
-                    image_placeholder.image(generated_image, caption="Generated Image", use_column_width=False, width=width, output_format="PNG", clamp=True)
-                else:
-                    image_placeholder.error("Failed to generate image. Please check the error messages above and try again.")
+    canvas_and_generation(width, height, bg_color, stroke_width, stroke_color, drawing_mode,
+                          prompt, style, strength, progressive)
     
     st.markdown("""
     ### Instructions
@@ -148,7 +120,8 @@ def main():
     3. The image will be automatically generated as you draw.
     4. Adjust the prompt, style, and creativity strength in the sidebar to change the generated image.
     5. Use 'Clear Canvas' in the sidebar to start over with a blank canvas.
+    6. Click 'Show' under a thumbnail to look at an earlier result again.
     """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    profiled(main)()
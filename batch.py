@@ -0,0 +1,158 @@
+"""Пакетная генерация без Streamlit: каталог эскизов и манифест с промптами.
+
+Запуск: python batch.py manifest.csv --sketches sketches/ --output out/ --workers 4
+
+Манифест - CSV с заголовком: sketch,prompt[,style,strength,width,height].
+Результаты пишутся по мере готовности, в out/results.jsonl ведётся журнал;
+при повторном запуске уже готовые строки пропускаются.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lcm_engine import encode_image, generate_lcm_image
+from rate_limiter import BACKGROUND, request_context
+from scheduler import GenerationError
+from sketch_encoder import split_data_url
+
+WORKERS = int(os.environ.get("LCM_BATCH_WORKERS", "4"))
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+
+
+class Job:
+    def __init__(self, sketch, prompt, style="CINEMATIC", strength=0.65, width=None, height=None):
+        self.sketch = sketch
+        self.prompt = prompt
+        self.style = style
+        self.strength = float(strength)
+        self.width = int(width) if width else None
+        self.height = int(height) if height else None
+
+    @property
+    def id(self):
+        # Стабилен при перестановке строк манифеста, поэтому годится для возобновления
+        parts = [self.sketch, self.prompt, self.style, f"{self.strength:.3f}", f"{self.width}x{self.height}"]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def read_manifest(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return [Job(**{k: v for k, v in row.items() if v not in (None, "")}) for row in rows]
+
+
+def read_done(log_path):
+    done = set()
+    if os.path.exists(log_path):
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Строка, оборванная прерыванием
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+    return done
+
+
+def load_sketch(path, width=None, height=None):
+    """RGBA-массив как у st_canvas, при необходимости приведённый к размеру холста."""
+    import numpy as np
+    from PIL import Image
+
+    img = Image.open(path).convert('RGBA')
+    if width and height and img.size != (width, height):
+        img = img.resize((width, height), Image.BILINEAR)
+    return np.asarray(img)
+
+
+def run_job(job, sketches_dir, output_dir, bg_color):
+    canvas = load_sketch(os.path.join(sketches_dir, job.sketch), job.width, job.height)
+    height, width = canvas.shape[:2]
+    image_data = encode_image(canvas, bg_color)
+    with request_context(BACKGROUND):
+        value = generate_lcm_image(image_data, job.prompt, width, height, job.style, job.strength)
+    if not value:
+        raise GenerationError("No image returned.")
+    mime, image_bytes = split_data_url(value)
+    stem = os.path.splitext(os.path.basename(job.sketch))[0]
+    path = os.path.join(output_dir, f"{stem}-{job.id}{EXTENSIONS.get(mime, '.img')}")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image_bytes)
+    os.replace(tmp_path, path)
+    return path
+
+
+def run(jobs, sketches_dir, output_dir, workers=WORKERS, bg_color="#ffffff"):
+    """Гоняет задания через пул; в полёте не больше workers штук одновременно."""
+    os.makedirs(output_dir, exist_ok=True)
+    log_path = os.path.join(output_dir, "results.jsonl")
+    done = read_done(log_path)
+    pending = [job for job in jobs if job.id not in done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run")
+
+    counts = {"ok": 0, "error": 0}
+    started = time.monotonic()
+    queue = iter(pending)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lcm-batch")
+    try:
+        with open(log_path, "a", encoding="utf-8") as log:
+            while True:
+                while len(running) < workers:
+                    job = next(queue, None)
+                    if job is None:
+                        break
+                    running[executor.submit(run_job, job, sketches_dir, output_dir, bg_color)] = (job, time.monotonic())
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job, submitted = running.pop(future)
+                    record = {"id": job.id, "sketch": job.sketch, "prompt": job.prompt,
+                              "style": job.style, "strength": job.strength,
+                              "seconds": round(time.monotonic() - submitted, 3)}
+                    try:
+                        record.update(status="ok", output=future.result())
+                    except Exception as e:
+                        message = " ".join(e.args) if isinstance(e, GenerationError) else repr(e)
+                        record.update(status="error", error=message)
+                    counts[record["status"]] += 1
+                    log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    log.flush()
+                    print(f"[{counts['ok'] + counts['error']}/{len(pending)}] {record['status']:<5} {job.sketch}"
+                          + (f": {record['error']}" if record["status"] == "error" else ""))
+    except KeyboardInterrupt:
+        print("Interrupted; finished jobs are saved, rerun to resume.")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.monotonic() - started
+    rate = counts["ok"] / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"{counts['ok']} ok, {counts['error']} failed in {elapsed:.1f}s: {rate:.1f} images/minute")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest")
+    parser.add_argument("--sketches", default=".", help="directory the manifest sketch paths are relative to")
+    parser.add_argument("--output", default="batch_output")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--bg-color", default="#ffffff")
+    args = parser.parse_args()
+
+    counts = run(read_manifest(args.manifest), args.sketches, args.output, args.workers, args.bg_color)
+    if counts["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Замер холодного старта фронтендов: импорт скрипта в свежем интерпретаторе.
+
+Запуск: python -m bench.cold_start --budget-ms 300 --output cold_start.json
+Время streamlit считается отдельно: он уже загружен сервером до запуска скрипта.
+Проверка не проходит, если импорт скрипта превышает бюджет или тянет тяжёлые модули.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FRONTENDS = ["app", "app2", "app2_dark"]
+HEAVY_MODULES = ["numpy", "PIL", "requests", "urllib3", "httpx", "streamlit_drawable_canvas"]
+BUDGET_MS = float(os.environ.get("LCM_COLD_START_BUDGET_MS", "300"))
+
+PROBE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+import streamlit
+streamlit_ms = (time.perf_counter() - started) * 1000
+before = set(sys.modules)
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+app_ms = (time.perf_counter() - started) * 1000
+loaded = set(sys.modules) - before
+print(json.dumps({
+    "streamlit_ms": streamlit_ms,
+    "app_ms": app_ms,
+    "heavy": sorted(m for m in json.loads(sys.argv[2]) if m in loaded),
+}))
+"""
+
+
+def measure(module, repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE, module, json.dumps(HEAVY_MODULES)],
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(samples, key=lambda sample: sample["app_ms"])
+    return {"module": module, **best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = [measure(module, args.repeat) for module in FRONTENDS]
+    failed = False
+    for r in results:
+        over = r["app_ms"] > args.budget_ms
+        failed = failed or over or bool(r["heavy"])
+        status = "FAIL" if over or r["heavy"] else "ok"
+        heavy = f" eager: {', '.join(r['heavy'])}" if r["heavy"] else ""
+        print(f"{r['module']:<10} {r['app_ms']:8.1f} ms (streamlit {r['streamlit_ms']:.0f} ms) {status}{heavy}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": results}, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
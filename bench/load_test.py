@@ -0,0 +1,212 @@
+"""Нагрузочный тест app2.py: много headless-сессий AppTest против mock LCM API.
+
+Запуск: python -m bench.load_test --levels 1 2 4 8 16 --strokes 10 --latency 0.5 --output load.json
+
+Каждая сессия воспроизводит ленту штрихов (синтетическую или из --timeline) и
+после каждого штриха ждёт, пока скрипт покажет результат. Холст подменяется:
+st_canvas возвращает растр штрихов, записанный в session_state сессии.
+
+Формат --timeline: JSON-список штрихов {"points": [[x, y], ...], "width": 3, "color": "#000000"}.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+
+from PIL import Image, ImageDraw
+
+from bench.mock_lcm_server import MockConfig, start_server
+
+CANVAS_KEY = "_load_test_canvas"
+WIDTH = HEIGHT = 512
+
+
+def synthetic_timeline(strokes, seed, width=WIDTH, height=HEIGHT):
+    rng = random.Random(seed)
+    return [
+        {
+            "points": [[rng.randrange(width), rng.randrange(height)] for _ in range(rng.randint(2, 8))],
+            "width": rng.randint(1, 25),
+            "color": "#000000",
+        }
+        for _ in range(strokes)
+    ]
+
+
+def frames(timeline, width=WIDTH, height=HEIGHT):
+    """RGBA-массивы холста после каждого штриха, как их отдаёт st_canvas."""
+    import numpy as np
+
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for stroke in timeline:
+        draw.line([tuple(p) for p in stroke["points"]], fill=stroke.get("color", "#000000"), width=stroke.get("width", 3))
+        yield np.array(img)
+
+
+def fake_canvas(**kwargs):
+    import streamlit as st
+
+    return types.SimpleNamespace(image_data=st.session_state.get(CANVAS_KEY), json_data=None)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss - пик, а не текущее значение; на Linux в КБ
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_session(script, timeline, timeout, think, samples, errors):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(script, default_timeout=timeout)
+    at.run()
+    for frame in frames(timeline):
+        time.sleep(think)
+        at.session_state[CANVAS_KEY] = frame
+        started = time.perf_counter()
+        try:
+            at.run()
+            failed = bool(at.exception) or bool(at.error)
+        except Exception:
+            failed = True
+        samples.append(time.perf_counter() - started)
+        if failed:
+            errors.append(1)
+    return at
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run_level(script, sessions, strokes, timeline, timeout, think, level_seed):
+    samples, errors, apps, crashed = [], [], [], []
+    rss_before = rss_bytes()
+
+    def worker(i):
+        session_timeline = timeline or synthetic_timeline(strokes, seed=level_seed * 1000 + i)
+        try:
+            apps.append(run_session(script, session_timeline, timeout, think, samples, errors))
+        except Exception:
+            # Упавшая сессия не должна выглядеть как прогон без ошибок
+            traceback.print_exc()
+            crashed.append(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # Сессии ещё живы, поэтому прирост RSS - их память (включая сам AppTest)
+    rss_per_session = (rss_bytes() - rss_before) / sessions
+
+    ordered = sorted(samples)
+    return {
+        "sessions": sessions,
+        "strokes": len(samples),
+        "seconds": round(elapsed, 3),
+        "strokes_per_second": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "crashed_sessions": len(crashed),
+        "rss_per_session_mb": round(rss_per_session / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--script", default="app2.py")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--strokes", type=int, default=10, help="strokes per session for synthetic timelines")
+    parser.add_argument("--timeline", help="recorded stroke timeline (JSON) replayed by every session")
+    parser.add_argument("--think", type=float, default=0.2, help="pause between strokes, seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="per-rerun timeout, seconds")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock API latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="mock API latency jitter, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock 500 responses")
+    parser.add_argument("--keys", type=int, default=1, help="number of API keys in the credential pool")
+    parser.add_argument("--key-rate", type=float, default=0.0, help="mock per-key requests per second (0 = unlimited)")
+    parser.add_argument("--key-concurrency", type=int, default=0, help="mock per-key concurrent requests (0 = unlimited)")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    # AppTest.from_file считает относительный путь от вызывающего файла (bench/), а не от cwd
+    script = os.path.abspath(args.script)
+
+    timeline = None
+    if args.timeline:
+        with open(args.timeline, encoding="utf-8") as f:
+            timeline = json.load(f)
+
+    keys = [f"load-key-{i}" for i in range(args.keys)]
+    mock_config = MockConfig(args.latency, args.jitter, args.error_rate,
+                             key_rate=args.key_rate, key_concurrency=args.key_concurrency, valid_keys=keys)
+    server, url = start_server(config=mock_config)
+    # Окружение задаётся до первого импорта модулей приложения
+    os.environ["LCM_API_URL"] = url
+    os.environ.setdefault("LCM_CACHE_DIR", tempfile.mkdtemp(prefix="lcm-load-"))
+    os.environ["LCM_API_KEYS"] = ",".join(keys)
+    # Клиент соблюдает те же лимиты на ключ, что и mock
+    if args.key_rate:
+        os.environ.setdefault("LCM_KEY_RATE", str(args.key_rate))
+        os.environ.setdefault("LCM_KEY_BURST", str(args.key_rate))
+    if args.key_concurrency:
+        os.environ.setdefault("LCM_KEY_CONCURRENCY", str(args.key_concurrency))
+    import lcm_engine
+
+    lcm_engine.st_canvas = fake_canvas
+
+    results = []
+    try:
+        for level in args.levels:
+            result = run_level(script, level, args.strokes, timeline, args.timeout, args.think, level)
+            results.append(result)
+            print(f"{level:>4} sessions  {result['strokes_per_second']:7.2f} strokes/s  "
+                  f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                  f"errors {result['error_rate']:6.1%}  {result['rss_per_session_mb']:6.1f} MB/session")
+            if result['crashed_sessions']:
+                print(f"      {result['crashed_sessions']} of {level} sessions crashed")
+    finally:
+        server.shutdown()
+
+    if args.output:
+        from bench.run_bench import git_revision
+
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "revision": git_revision(),
+                "python": sys.version.split()[0],
+                "script": args.script,
+                "mock_latency": args.latency,
+                "mock_jitter": args.jitter,
+                "mock_error_rate": args.error_rate,
+                "mock_requests": mock_config.requests,
+                "keys": args.keys,
+                "mock_by_key": mock_config.by_key,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if any(result["crashed_sessions"] for result in results):
+        sys.exit("some sessions crashed, see the tracebacks above")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Локальная замена /api/rest/v1/generations-lcm для бенчмарков и нагрузочных тестов.
+
+Запуск: python -m bench.mock_lcm_server --port 8765 --latency 0.8 --jitter 0.2 --error-rate 0.05
+Лимиты на ключ: --key-rate 2 --key-concurrency 1 --keys key-a key-b
+"""
+import argparse
+import base64
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+LCM_PATH = "/api/rest/v1/generations-lcm"
+REQUIRED_FIELDS = ("width", "height", "imageDataUrl", "prompt", "style", "strength")
+
+
+class MockConfig:
+    """Поведение mock API; key_rate/key_concurrency включают лимиты на каждый ключ, как у настоящего API."""
+
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0, rate_limit_rate=0.0,
+                 key_rate=0.0, key_concurrency=0, valid_keys=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.key_rate = key_rate
+        self.key_concurrency = key_concurrency
+        self.valid_keys = set(valid_keys) if valid_keys else None
+        self.requests = 0
+        self.errors = 0
+        self.by_key = {}
+        self._lock = threading.Lock()
+        self._images = {}
+        self._buckets = {}
+        self._in_flight = {}
+
+    def admit(self, key):
+        """Проверяет лимиты ключа; возвращает код ошибки или None и занимает слот."""
+        if self.valid_keys is not None and key not in self.valid_keys:
+            return 401
+        with self._lock:
+            stats = self.by_key.setdefault(key, {"requests": 0, "rejected": 0})
+            stats["requests"] += 1
+            if self.key_concurrency and self._in_flight.get(key, 0) >= self.key_concurrency:
+                stats["rejected"] += 1
+                return 429
+            if self.key_rate:
+                now = time.monotonic()
+                tokens, updated = self._buckets.get(key, (self.key_rate, now))
+                tokens = min(self.key_rate, tokens + (now - updated) * self.key_rate)
+                if tokens < 1:
+                    self._buckets[key] = (tokens, now)
+                    stats["rejected"] += 1
+                    return 429
+                self._buckets[key] = (tokens - 1, now)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return None
+
+    def release(self, key):
+        with self._lock:
+            self._in_flight[key] -= 1
+
+    def count(self, error=False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+    def image_data_url(self, width, height):
+        # Шумовая картинка сжимается примерно как настоящий результат
+        with self._lock:
+            if (width, height) not in self._images:
+                img = Image.effect_noise((width, height), 48).convert('RGB')
+                buffered = io.BytesIO()
+                img.save(buffered, format="JPEG", quality=90)
+                encoded = base64.b64encode(buffered.getvalue()).decode('ascii')
+                self._images[(width, height)] = f"data:image/jpeg;base64,{encoded}"
+            return self._images[(width, height)]
+
+
+class LCMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+
+        if self.path != LCM_PATH:
+            config.count(error=True)
+            return self._reply(404, {"error": "not found"})
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            config.count(error=True)
+            return self._reply(401, {"error": "missing bearer token"})
+        key = authorization[len("Bearer "):]
+        try:
+            payload = json.loads(raw)
+            missing = [field for field in REQUIRED_FIELDS if field not in payload]
+            if not missing:
+                width, height = int(payload["width"]), int(payload["height"])
+        except (ValueError, TypeError):
+            missing = ["body"]
+        if missing:
+            config.count(error=True)
+            return self._reply(400, {"error": f"invalid payload: {', '.join(missing)}"})
+
+        status = config.admit(key)
+        if status == 401:
+            config.count(error=True)
+            return self._reply(401, {"error": "invalid api key"})
+        if status == 429:
+            config.count(error=True)
+            return self._reply(429, {"error": "rate limited for this key"}, {"Retry-After": "1"})
+        try:
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+        finally:
+            config.release(key)
+
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            config.count(error=True)
+            return self._reply(429, {"error": "rate limited"}, {"Retry-After": "1"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.count(error=True)
+            return self._reply(500, {"error": "internal error"})
+
+        config.count()
+        self._reply(200, {"lcmGenerationJob": {"imageDataUrl": [config.image_data_url(width, height)]}})
+
+
+def make_server(host="127.0.0.1", port=0, config=None):
+    server = ThreadingHTTPServer((host, port), LCMHandler)
+    server.daemon_threads = True
+    server.config = config or MockConfig()
+    return server
+
+
+def start_server(host="127.0.0.1", port=0, config=None):
+    """Запускает сервер в фоновом потоке; возвращает (server, url)."""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{LCM_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean response latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="uniform latency jitter, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--key-rate", type=float, default=0.0, help="requests per second allowed per API key")
+    parser.add_argument("--key-concurrency", type=int, default=0, help="concurrent requests allowed per API key")
+    parser.add_argument("--keys", nargs="*", help="accepted API keys; any other key gets 401")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                        args.key_rate, args.key_concurrency, args.keys)
+    server = make_server(args.host, args.port, config)
+    print(f"Mock LCM API on http://{args.host}:{args.port}{LCM_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
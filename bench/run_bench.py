@@ -0,0 +1,162 @@
+"""Офлайн-бенчмарк пути генерации против локального mock LCM API.
+
+Запуск: python -m bench.run_bench --iterations 20 --latency 0.05 --output bench_results.json
+С --baseline прошлый файл результатов сравнивается с текущим по p50.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from bench.mock_lcm_server import MockConfig, start_server
+from change_detect import raster_fingerprint
+from lcm_client import LCMClient
+from lcm_engine import decode_result, encode_image, request_lcm_image
+
+SIZES = ["512x512", "768x768", "1024x1024", "512x768", "768x512", "1024x768", "768x1024"]
+
+
+def synthetic_sketch(width, height, strokes=40, seed=0):
+    """RGBA-массив как у st_canvas: штрихи на прозрачном фоне."""
+    rng = random.Random(seed)
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(strokes):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randint(2, 8))]
+        draw.line(points, fill=(0, 0, 0, 255), width=rng.randint(1, 25))
+    return np.array(img)
+
+
+def generate(client, url, image_data, width, height):
+    return request_lcm_image(image_data, "bench", width, height, client=client, url=url, api_key="bench")
+
+
+def timed(func, iterations):
+    samples = []
+    value = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        value = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples, value
+
+
+def summarize(size, stage, samples, **extra):
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "size": size,
+        "stage": stage,
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(percentile(0.50), 3),
+        "p95_ms": round(percentile(0.95), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(ordered[-1], 3),
+        **extra,
+    }
+
+
+def run(iterations, sizes, mock_config):
+    server, url = start_server(config=mock_config)
+    client = LCMClient(retries=0, limiter=None)
+    results = []
+    try:
+        for size in sizes:
+            width, height = map(int, size.split('x'))
+            canvas = synthetic_sketch(width, height)
+
+            samples, image_data = timed(lambda: encode_image(canvas, "#ffffff"), iterations)
+            results.append(summarize(size, "encode", samples, payload_bytes=len(image_data)))
+
+            samples, result = timed(lambda: generate(client, url, image_data, width, height), iterations)
+            results.append(summarize(size, "round_trip", samples, response_bytes=len(result)))
+
+            samples, _ = timed(lambda: decode_result(result), iterations)
+            results.append(summarize(size, "decode", samples))
+
+            def stroke():
+                raster_fingerprint(canvas)
+                return decode_result(generate(client, url, encode_image(canvas, "#ffffff"), width, height))
+
+            samples, _ = timed(stroke, iterations)
+            results.append(summarize(size, "stroke", samples))
+    finally:
+        server.shutdown()
+    return results, client.stats.snapshot()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["size"], r["stage"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["size"], result["stage"]))
+        if previous and previous["p50_ms"] > 0:
+            change = result["p50_ms"] / previous["p50_ms"] - 1
+            if change > threshold:
+                regressions.append((result["size"], result["stage"], previous["p50_ms"], result["p50_ms"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--sizes", nargs="+", default=SIZES)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock API latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock API latency jitter, seconds")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare p50 against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown vs baseline")
+    args = parser.parse_args()
+
+    results, pool_stats = run(args.iterations, args.sizes, MockConfig(args.latency, args.jitter))
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "mock_latency": args.latency,
+            "mock_jitter": args.jitter,
+            "pool": pool_stats,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        print(f"{r['size']:>10} {r['stage']:<11} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.threshold)
+        for size, stage, before, after, change in regressions:
+            print(f"REGRESSION {size} {stage}: p50 {before:.2f} -> {after:.2f} ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
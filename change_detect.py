@@ -0,0 +1,44 @@
+import os
+
+# Холст сводится к сетке GRID x GRID средних цветов (около 12 КБ на сессию)
+GRID = int(os.environ.get("LCM_CHANGE_GRID", "64"))
+# Насколько (0-255) должна измениться ячейка, чтобы считаться изменённой
+PIXEL_THRESHOLD = int(os.environ.get("LCM_CHANGE_PIXEL_THRESHOLD", "12"))
+# Минимальная доля изменённых ячеек для запуска генерации
+MIN_CHANGE = float(os.environ.get("LCM_CHANGE_MIN_FRACTION", "0.001"))
+
+
+def raster_fingerprint(image_data, bg_color="#ffffff", grid=GRID):
+    """Уменьшенный растр холста: RGBA накладывается на цвет фона и усредняется по блокам.
+
+    Фон тот же, что у sketch_encoder.composite: на белом фоне белый штрих
+    неотличим от пустого холста, а на тёмном - виден.
+    """
+    import numpy as np
+
+    from sketch_encoder import hex_to_rgb
+
+    rgba = np.asarray(image_data)
+    h, w = rgba.shape[:2]
+    fy, fx = max(h // grid, 1), max(w // grid, 1)
+    rgba = rgba[:h - h % fy, :w - w % fx]
+    h, w = rgba.shape[:2]
+    alpha = rgba[..., 3:4].astype(np.float32) / 255
+    bg = np.array(hex_to_rgb(bg_color), dtype=np.float32)
+    rgb = rgba[..., :3] * alpha + bg * (1 - alpha)
+    cells = rgb.reshape(h // fy, fy, w // fx, fx, 3).mean(axis=(1, 3))
+    return cells.astype(np.uint8)
+
+
+def changed_fraction(previous, current, threshold=PIXEL_THRESHOLD):
+    import numpy as np
+
+    if previous is None or previous.shape != current.shape:
+        return 1.0
+    diff = np.abs(previous.astype(np.int16) - current.astype(np.int16)).max(axis=2)
+    return np.count_nonzero(diff > threshold) / diff.size
+
+
+def has_visual_change(previous, current, min_fraction=MIN_CHANGE, threshold=PIXEL_THRESHOLD):
+    fraction = changed_fraction(previous, current, threshold)
+    return fraction > 0 and fraction >= min_fraction
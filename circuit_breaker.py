@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS
+
+# Окно последних вызовов, по которому считаются доли ошибок и медленных ответов
+WINDOW = int(os.environ.get("LCM_BREAKER_WINDOW", "20"))
+MIN_CALLS = int(os.environ.get("LCM_BREAKER_MIN_CALLS", "10"))
+ERROR_RATE = float(os.environ.get("LCM_BREAKER_ERROR_RATE", "0.5"))
+SLOW_CALL = float(os.environ.get("LCM_BREAKER_SLOW_SECONDS", "15"))
+SLOW_RATE = float(os.environ.get("LCM_BREAKER_SLOW_RATE", "0.8"))
+COOLDOWN = float(os.environ.get("LCM_BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_in):
+        super().__init__(f"circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Предохранитель перед API: closed -> open -> half-open -> closed.
+
+    Размыкается, когда в окне последних вызовов слишком много ошибок или
+    медленных ответов. Пока разомкнут, вызовы сразу получают CircuitOpen;
+    через COOLDOWN пропускается один пробный вызов, и по его исходу цепь
+    замыкается или снова размыкается.
+    """
+
+    def __init__(self, window=WINDOW, min_calls=MIN_CALLS, error_rate=ERROR_RATE,
+                 slow_call=SLOW_CALL, slow_rate=SLOW_RATE, cooldown=COOLDOWN):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+        return self._state
+
+    def check(self):
+        """Поднимает CircuitOpen, пока цепь разомкнута; пробный вызов при этом не занимается."""
+        with self._lock:
+            now = time.monotonic()
+            if self._current_state(now) != OPEN:
+                return
+            self.rejected += 1
+            METRICS.count("breaker_rejected")
+            raise CircuitOpen(max(self._opened_at + self.cooldown - now, 0.0))
+
+    def before_call(self):
+        """Разрешает вызов или поднимает CircuitOpen; True - это пробный вызов half-open.
+
+        После разрешения обязателен record() или release() с тем же флагом probe.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            METRICS.count("breaker_rejected")
+            raise CircuitOpen(max(self._opened_at + self.cooldown - now, 0.0))
+
+    def record(self, success, latency, probe=False):
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probing = False
+                if success and latency < self.slow_call:
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+            # Вызовы, пропущенные до размыкания, состояние open/half-open не меняют
+            if self._state != CLOSED:
+                return
+            self._calls.append((success, latency >= self.slow_call))
+            if len(self._calls) >= self.min_calls:
+                failures = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+                slow = sum(1 for _, is_slow in self._calls if is_slow) / len(self._calls)
+                if failures >= self.error_rate or slow >= self.slow_rate:
+                    self._open(now)
+
+    def release(self, probe=False):
+        """Вызов не дошёл до API (очередь, отмена): исход не учитывается."""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.opened += 1
+        METRICS.count("breaker_opened")
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                "state": state,
+                "retry_in": max(self._opened_at + self.cooldown - now, 0.0) if state == OPEN else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
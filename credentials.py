@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+
+from metrics import METRICS
+from rate_limiter import QUEUE_TIMEOUT, QueueTimeout, RateLimiter, RequestCancelled, is_cancelled
+
+# Лимиты одного ключа: одновременных запросов и запросов в секунду
+KEY_CONCURRENCY = int(os.environ.get("LCM_KEY_CONCURRENCY", "4"))
+KEY_RATE = float(os.environ.get("LCM_KEY_RATE", "5"))
+KEY_BURST = float(os.environ.get("LCM_KEY_BURST", "10"))
+# На сколько секунд ключ выводится из ротации после 429 (если нет Retry-After) и после 401/403
+EJECT_RATE_LIMITED = float(os.environ.get("LCM_KEY_EJECT", "30"))
+EJECT_UNAUTHORIZED = float(os.environ.get("LCM_KEY_EJECT_AUTH", "600"))
+
+
+class NoHealthyKey(Exception):
+    """Все ключи выведены из ротации; status - код последнего ответа (429 или 401/403)."""
+
+    def __init__(self, status, retry_in):
+        super().__init__(f"all API keys are ejected after HTTP {status}, retry in {retry_in:.0f}s")
+        self.status = status
+        self.retry_in = retry_in
+
+
+def load_api_keys():
+    """Ключи из LCM_API_KEYS (через запятую), иначе LEONARDO_API_KEYS / LEONARDO_API_KEY из const."""
+    keys = [key.strip() for key in os.environ.get("LCM_API_KEYS", "").split(",") if key.strip()]
+    if keys:
+        return keys
+    import const
+
+    return list(getattr(const, "LEONARDO_API_KEYS", None) or [const.LEONARDO_API_KEY])
+
+
+class ApiKey:
+    def __init__(self, key, concurrency=KEY_CONCURRENCY, rate=KEY_RATE, burst=KEY_BURST):
+        self.key = key
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate, burst)
+        self.in_flight = 0
+        self.ejected_until = 0.0
+        self.ejected_status = None
+        self.requests = 0
+        self.ejections = 0
+
+    @property
+    def label(self):
+        # В логах и на дашборде ключ не показывается целиком
+        return f"…{self.key[-4:]}"
+
+    @property
+    def load(self):
+        return self.in_flight / self.concurrency
+
+
+class CredentialPool:
+    """Пул API-ключей: запрос уходит на наименее загруженный здоровый ключ.
+
+    У каждого ключа свой лимит одновременных запросов и свой token bucket.
+    Ключ, получивший 429 или 401/403, временно выводится из ротации, если
+    остаются другие здоровые ключи; последний здоровый ключ не выводится.
+    """
+
+    def __init__(self, keys, concurrency=KEY_CONCURRENCY, rate=KEY_RATE, burst=KEY_BURST):
+        if not keys:
+            raise ValueError("no API keys configured")
+        self.keys = [ApiKey(key, concurrency, rate, burst) for key in keys]
+        self._cond = threading.Condition()
+
+    @property
+    def total_rate(self):
+        return sum(key.limiter.rate for key in self.keys)
+
+    def healthy(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [key for key in self.keys if key.ejected_until <= now]
+
+    def acquire(self, timeout=QUEUE_TIMEOUT):
+        """Занимает слот ключа и токен его лимитера; вернуть через release()."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if is_cancelled():
+                    raise RequestCancelled()
+                if now >= deadline:
+                    raise QueueTimeout(f"waited {timeout:.0f}s for a free API key")
+                if not self.healthy(now):
+                    # Ждать в очереди бессмысленно: сразу отдаём причину
+                    key = min(self.keys, key=lambda k: k.ejected_until)
+                    raise NoHealthyKey(key.ejected_status, key.ejected_until - now)
+                free = [key for key in self.healthy(now) if key.in_flight < key.concurrency]
+                if free:
+                    key = min(free, key=lambda k: (k.load, k.limiter.stats()["depth"]))
+                    key.in_flight += 1
+                    key.requests += 1
+                    break
+                self._cond.wait(min(0.1, deadline - now))
+        try:
+            key.limiter.acquire(max(deadline - time.monotonic(), 0.0))
+        except BaseException:
+            self.release(key)
+            raise
+        return key
+
+    def try_acquire(self):
+        """Как acquire(), но без ожидания: None, если нет ключа со свободным слотом и токеном."""
+        with self._cond:
+            free = [key for key in self.healthy() if key.in_flight < key.concurrency]
+            for key in sorted(free, key=lambda k: k.load):
+                if key.limiter.try_acquire():
+                    key.in_flight += 1
+                    key.requests += 1
+                    return key
+        return None
+
+    def release(self, key):
+        with self._cond:
+            key.in_flight -= 1
+            self._cond.notify_all()
+
+    def report(self, key, response):
+        """Учитывает ответ: 429 и 401/403 выводят ключ из ротации; True, если ключ выведен."""
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            try:
+                seconds = float(retry_after) if retry_after is not None else EJECT_RATE_LIMITED
+            except ValueError:
+                seconds = EJECT_RATE_LIMITED
+            return self.eject(key, seconds, response.status_code)
+        if response.status_code in (401, 403):
+            return self.eject(key, EJECT_UNAUTHORIZED, response.status_code)
+        return False
+
+    def eject(self, key, seconds, status=None):
+        """Выводит ключ из ротации, если он не последний здоровый; True, если выведен.
+
+        Последний ключ остаётся: 429 тогда обрабатывается паузой лимитера и
+        повтором, а 401/403 сразу возвращается вызывающему.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if key.ejected_until <= now and not any(other is not key for other in self.healthy(now)):
+                return False
+            key.ejected_until = max(key.ejected_until, now + seconds)
+            key.ejected_status = status
+            key.ejections += 1
+            self._cond.notify_all()
+        METRICS.count("api_key_ejections")
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return [
+                {
+                    "key": key.label,
+                    "in_flight": key.in_flight,
+                    "requests": key.requests,
+                    "ejections": key.ejections,
+                    "ejected_for": max(key.ejected_until - now, 0.0),
+                }
+                for key in self.keys
+            ]
@@ -0,0 +1,107 @@
+"""Общие для процесса пулы: процессы для CPU-работы, потоки для сетевых запросов.
+
+Сессии не держат собственных потоков: они отдают задачи в пулы и получают Future.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import streamlit as st
+
+from metrics import METRICS
+from sketch_encoder import encode_image, encode_job
+
+logger = logging.getLogger(__name__)
+_pool_lock = threading.Lock()
+
+# 0 - кодировать в процессе сервера; по умолчанию на одно ядро меньше, чем есть.
+# Одно кодирование в пуле не быстрее, чем в процессе (1024x1024: 0.054 s против 0.046 s
+# из-за пересылки 4 МБ RGBA), зато оно не держит GIL сервера при многих сессиях
+CPU_WORKERS = int(os.environ.get("LCM_CPU_WORKERS", str(min(4, (os.cpu_count() or 1) - 1))))
+IO_WORKERS = int(os.environ.get("LCM_IO_WORKERS", "32"))
+# Отдельный небольшой пул префетча: он не должен занимать потоки интерактивных генераций
+PREFETCH_WORKERS = int(os.environ.get("LCM_PREFETCH_WORKERS", "2"))
+
+
+@st.cache_resource
+def get_cpu_pool(max_workers=CPU_WORKERS):
+    if max_workers <= 0:
+        return None
+    # spawn: fork процесса с потоками Streamlit небезопасен
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+@st.cache_resource
+def get_io_pool(max_workers=IO_WORKERS):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lcm-io")
+
+
+@st.cache_resource
+def get_prefetch_pool(max_workers=PREFETCH_WORKERS):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lcm-prefetch")
+
+
+def _encode_inline(future, image_data, bg_color):
+    try:
+        future.set_result(encode_image(image_data, bg_color))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _drop_broken_pool(pool):
+    # Пул с умершим процессом отказывает во всех submit: пересоздаём его при следующем вызове.
+    # Сломанный пул видят сразу несколько задач - сбрасываем кэш, только пока в нём именно он
+    with _pool_lock:
+        if get_cpu_pool() is not pool:
+            return
+        logger.warning("CPU pool is broken, recreating it; encoding in-process meanwhile")
+        METRICS.count("cpu_pool_broken")
+        get_cpu_pool.clear()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_encode(image_data, bg_color="#ffffff"):
+    """Кодирует холст в пуле процессов; возвращает Future с data URL.
+
+    cancel() у Future снимает с очереди пула ещё не начатое кодирование.
+    Если пул сломан (умер процесс), кодирование идёт в текущем процессе.
+    """
+    pool = get_cpu_pool()
+    if pool is None:
+        return _encode_inline(Future(), image_data, bg_color)
+
+    submitted = time.perf_counter()
+    outer = Future()
+
+    def done(inner):
+        # False - outer уже отменён (снимок заменён новым), результат не нужен
+        if not outer.set_running_or_notify_cancel():
+            return
+        try:
+            value, seconds = inner.result()
+        except BrokenProcessPool:
+            _drop_broken_pool(pool)
+            _encode_inline(outer, image_data, bg_color)
+            return
+        except Exception as e:
+            outer.set_exception(e)
+            return
+        # Метрики дочернего процесса сюда не попадают, поэтому пишем их здесь
+        METRICS.observe("stage_seconds", seconds, "encode")
+        METRICS.observe("stage_seconds", time.perf_counter() - submitted - seconds, "encode_queue")
+        METRICS.observe("payload_bytes", len(value))
+        outer.set_result(value)
+
+    try:
+        inner = pool.submit(encode_job, image_data, bg_color)
+    except BrokenProcessPool:
+        _drop_broken_pool(pool)
+        return _encode_inline(outer, image_data, bg_color)
+    outer.add_done_callback(lambda future: future.cancelled() and inner.cancel())
+    inner.add_done_callback(done)
+    return outer
@@ -0,0 +1,134 @@
+import io
+import itertools
+import os
+import time
+from collections import deque
+
+import streamlit as st
+
+from sketch_encoder import split_data_url
+
+HISTORY_BYTES = int(float(os.environ.get("LCM_HISTORY_MB", "8")) * 1024 * 1024)
+THUMB_SIZE = int(os.environ.get("LCM_HISTORY_THUMB_SIZE", "128"))
+# Сколько последних миниатюр показывать в ленте
+VISIBLE = int(os.environ.get("LCM_HISTORY_VISIBLE", "8"))
+
+_ids = itertools.count(1)
+
+
+def make_thumbnail(image_bytes, size=THUMB_SIZE):
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # Для JPEG draft() декодирует сразу в уменьшенном масштабе
+    img.draft('RGB', (size, size))
+    img = img.convert('RGB')
+    img.thumbnail((size, size))
+    buffered = io.BytesIO()
+    img.save(buffered, format="JPEG", quality=70)
+    return buffered.getvalue()
+
+
+class HistoryEntry:
+    def __init__(self, image_bytes, mime, thumbnail, prompt, style, strength, width, height):
+        self.id = next(_ids)
+        self.image_bytes = image_bytes
+        self.mime = mime
+        self.thumbnail = thumbnail
+        self.prompt = prompt
+        self.style = style
+        self.strength = strength
+        self.width = width
+        self.height = height
+        self.created = time.time()
+
+    @property
+    def nbytes(self):
+        return len(self.image_bytes) + len(self.thumbnail)
+
+    @property
+    def caption(self):
+        return f"{self.style} · {self.strength:.2f} · {self.prompt or 'no prompt'}"
+
+
+class GenerationHistory:
+    """Кольцевой буфер результатов сессии с ограничением по байтам.
+
+    Хранит байты картинки в том виде, в каком их вернул API, и заранее
+    посчитанную миниатюру; старые записи вытесняются при превышении лимита.
+    """
+
+    def __init__(self, max_bytes=HISTORY_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = deque()
+        self.nbytes = 0
+        self.selected = None
+        self._last_seq = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, result):
+        """Добавляет итоговый результат планировщика (один раз на seq)."""
+        if not result.value or not result.final or result.seq == self._last_seq:
+            return None
+        self._last_seq = result.seq
+        mime, image_bytes = split_data_url(result.value)
+        _, prompt, width, height, style, strength = result.snapshot
+        entry = HistoryEntry(image_bytes, mime, make_thumbnail(image_bytes), prompt, style, strength, width, height)
+        if entry.nbytes > self.max_bytes:
+            return None
+        self.entries.append(entry)
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self.entries.popleft().nbytes
+        # Новый результат возвращает просмотр к живому изображению
+        self.selected = None
+        return entry
+
+    def shrink(self, nbytes):
+        """Вытесняет старые записи, пока не освободится nbytes; возвращает освобождённое."""
+        freed = 0
+        while self.entries and freed < nbytes:
+            entry = self.entries.popleft()
+            self.nbytes -= entry.nbytes
+            freed += entry.nbytes
+        return freed
+
+    def get(self, entry_id):
+        for entry in self.entries:
+            if entry.id == entry_id:
+                return entry
+        return None
+
+
+def get_history():
+    if 'generation_history' not in st.session_state:
+        st.session_state.generation_history = GenerationHistory()
+    return st.session_state.generation_history
+
+
+def render_history(container, image_placeholder, width):
+    """Лента миниатюр; выбранная запись показывается вместо последнего результата."""
+    from lcm_engine import rerun
+
+    history = get_history()
+    if not history.entries:
+        return
+
+    selected = history.get(history.selected) if history.selected is not None else None
+    if selected is not None:
+        image_placeholder.image(selected.image_bytes, caption=f"History: {selected.caption}", width=width)
+
+    with container:
+        st.caption(f"History ({len(history)} images, {history.nbytes / 1024:.0f} KB)")
+        recent = list(history.entries)[-VISIBLE:][::-1]
+        columns = st.columns(VISIBLE)
+        for column, entry in zip(columns, recent):
+            column.image(entry.thumbnail, use_column_width=True)
+            if column.button("Show", key=f"history_{entry.id}", help=entry.caption):
+                history.selected = entry.id
+                rerun(fragment_only=True)
+        if selected is not None and st.button("Back to latest"):
+            history.selected = None
+            rerun(fragment_only=True)
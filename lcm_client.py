@@ -0,0 +1,421 @@
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import streamlit as st
+
+from circuit_breaker import CIRCUIT_BREAKER
+from credentials import CredentialPool, load_api_keys
+from metrics import METRICS, percentile
+from rate_limiter import RATE_LIMITER
+
+logger = logging.getLogger(__name__)
+
+API_URL = os.environ.get("LCM_API_URL", "https://cloud.leonardo.ai/api/rest/v1/generations-lcm")
+POOL_SIZE = int(os.environ.get("LCM_POOL_SIZE", "10"))
+RETRIES = int(os.environ.get("LCM_RETRIES", "3"))
+BACKOFF = float(os.environ.get("LCM_BACKOFF", "0.5"))
+BACKOFF_MAX = float(os.environ.get("LCM_BACKOFF_MAX", "8"))
+HTTP2 = os.environ.get("LCM_HTTP2", "0") == "1"
+# Таймаут берётся из p99 последних ответов * TIMEOUT_FACTOR в пределах [TIMEOUT_MIN, TIMEOUT]
+TIMEOUT = float(os.environ.get("LCM_TIMEOUT", "30"))
+TIMEOUT_MIN = float(os.environ.get("LCM_TIMEOUT_MIN", "5"))
+TIMEOUT_FACTOR = float(os.environ.get("LCM_TIMEOUT_FACTOR", "3"))
+LATENCY_WINDOW = int(os.environ.get("LCM_LATENCY_WINDOW", "200"))
+LATENCY_MIN_SAMPLES = int(os.environ.get("LCM_LATENCY_MIN_SAMPLES", "20"))
+# Дублировать запрос, если ответа нет дольше p95 (каждая генерация стоит кредитов, поэтому выключено)
+HEDGE = os.environ.get("LCM_HEDGE", "0") == "1"
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class PoolStats:
+    """Счётчики пула: hit - запрос ушёл по уже открытому соединению."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.misses = 0
+        self.retries = 0
+
+    def checkout(self):
+        with self._lock:
+            self.requests += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def hits(self):
+        return max(self.requests - self.misses, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "misses": self.misses,
+                "retries": self.retries,
+            }
+
+
+def _counting_pool(base, stats):
+    class CountingPool(base):
+        def _get_conn(self, timeout=None):
+            stats.checkout()
+            return super()._get_conn(timeout)
+
+        def _new_conn(self):
+            stats.miss()
+            return super()._new_conn()
+
+    return CountingPool
+
+
+def _pooled_adapter(stats, **kwargs):
+    # requests и urllib3 импортируются только при создании клиента
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class PooledAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _counting_pool(HTTPConnectionPool, stats),
+                "https": _counting_pool(HTTPSConnectionPool, stats),
+            }
+
+    return PooledAdapter(**kwargs)
+
+
+class LatencyTracker:
+    """Скользящее окно времени ответа API для таймаута и порога хеджирования."""
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES,
+                 ceiling=TIMEOUT, floor=TIMEOUT_MIN, factor=TIMEOUT_FACTOR):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.ceiling = ceiling
+        self.floor = floor
+        self.factor = factor
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q):
+        """None, пока замеров меньше min_samples."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return percentile(ordered, q)
+
+    def timeout(self):
+        p99 = self.quantile(0.99)
+        if p99 is None:
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, p99 * self.factor))
+
+    def hedge_delay(self):
+        return self.quantile(0.95)
+
+
+def _close_response(future):
+    # Проигравший запрос не прерывается на лету: его ответ просто закрывается
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class _HTTPXResponse:
+    """Ответ httpx с интерфейсом requests, чтобы обработка ошибок не менялась."""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self):
+        return self._response.json()
+
+    def close(self):
+        self._response.close()
+
+    def raise_for_status(self):
+        import requests
+
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} Error for url: {self._response.url}", response=self
+            )
+
+
+class LCMClient:
+    """Общий для процесса HTTP-клиент с keep-alive пулом и повторами."""
+
+    def __init__(self, pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF,
+                 backoff_max=BACKOFF_MAX, http2=HTTP2, limiter=RATE_LIMITER, hedge=HEDGE,
+                 breaker=CIRCUIT_BREAKER, credentials=None):
+        import requests
+
+        self.limiter = limiter
+        self.breaker = breaker
+        self._credentials = credentials
+        self._credentials_lock = threading.Lock()
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.stats = PoolStats()
+        # Задержка сильно зависит от размера результата: превью 512 и полный размер
+        # не должны делить один таймаут и порог хеджирования
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+        self._hedge_executor = None
+        if hedge:
+            # Первичный и дублирующий запросы, по два на соединение пула
+            self._hedge_executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix="lcm-hedge")
+        self._httpx = None
+        if http2:
+            try:
+                import httpx
+                self._httpx = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                )
+                self._streams = weakref.WeakSet()
+                self._streams_lock = threading.Lock()
+            except ImportError:
+                logger.warning("HTTP/2 requested but httpx[http2] is not installed, using HTTP/1.1")
+        self._session = requests.Session()
+        adapter = _pooled_adapter(self.stats, pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    @property
+    def credentials(self):
+        """Пул ключей; по умолчанию загружается при первом запросе без authorization."""
+        with self._credentials_lock:
+            if self._credentials is None:
+                self._credentials = CredentialPool(load_api_keys())
+                if self.limiter is not None and "LCM_RATE_LIMIT" not in os.environ:
+                    # Квота процесса растёт с числом ключей, если не задана явно
+                    self.limiter.set_rate(max(self.limiter.rate, self._credentials.total_rate))
+            return self._credentials
+
+    def credential_stats(self):
+        """Состояние ключей или None, если пул ещё не загружен."""
+        return self._credentials.stats() if self._credentials is not None else None
+
+    def latency_for(self, json):
+        """LatencyTracker для размера результата (width * height из тела запроса)."""
+        bucket = (json or {}).get("width", 0) * (json or {}).get("height", 0)
+        with self._latency_lock:
+            if bucket not in self._latency:
+                self._latency[bucket] = LatencyTracker()
+            return self._latency[bucket]
+
+    @property
+    def http2(self):
+        return self._httpx is not None
+
+    def _send(self, url, json, headers, timeout):
+        if self._httpx is None:
+            return self._session.post(url, json=json, headers=headers, timeout=timeout)
+
+        import httpx
+        import requests
+
+        self.stats.checkout()
+        try:
+            response = self._httpx.post(url, json=json, headers=headers, timeout=timeout)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        stream = response.extensions.get("network_stream")
+        if stream is not None:
+            with self._streams_lock:
+                if stream not in self._streams:
+                    self._streams.add(stream)
+                    self.stats.miss()
+        return _HTTPXResponse(response)
+
+    def _timed_send(self, url, json, headers, timeout):
+        import requests
+
+        started = time.perf_counter()
+        try:
+            response = self._send(url, json, headers, timeout)
+        except requests.exceptions.Timeout:
+            # Оборванный замер всё равно сдвигает распределение вверх
+            self.latency_for(json).observe(timeout)
+            raise
+        if response.status_code < 500:
+            self.latency_for(json).observe(time.perf_counter() - started)
+        return response
+
+    def _keyed_send(self, url, json, headers, timeout, key):
+        """Отправка, которой принадлежит аренда ключа: слот освобождается, когда запрос завершён."""
+        try:
+            return self._timed_send(url, json, headers, timeout)
+        finally:
+            self._release(key)
+
+    def _submit_send(self, url, json, headers, timeout, key):
+        future = self._hedge_executor.submit(self._keyed_send, url, json, headers, timeout, key)
+        # Отменённая до старта отправка тоже возвращает ключ
+        future.add_done_callback(lambda f: f.cancelled() and self._release(key))
+        return future
+
+    def _release(self, key):
+        if key is not None:
+            self.credentials.release(key)
+
+    def _hedged_send(self, url, json, headers, timeout, key=None):
+        """Если ответа нет дольше p95, отправляет дубликат; побеждает первый успешный.
+
+        Берёт на себя аренду key и возвращает (response, ключ победившего запроса).
+        Дубликат идёт со своим ключом из пула, взятым без ожидания (слот и токен).
+        """
+        delay = self.latency_for(json).hedge_delay() if self._hedge_executor is not None else None
+        if delay is None:
+            return self._keyed_send(url, json, headers, timeout, key), key
+
+        primary = self._submit_send(url, json, headers, timeout, key)
+        try:
+            return primary.result(timeout=delay), key
+        except FutureTimeout:
+            pass
+        # Дубликат не встаёт ни в очередь ключей, ни в очередь лимитера: нет свободных - ждём первичный
+        hedge_key, hedge_headers = None, headers
+        if key is not None:
+            hedge_key = self.credentials.try_acquire()
+            if hedge_key is None:
+                return primary.result(), key
+            hedge_headers = {**headers, "authorization": f"Bearer {hedge_key.key}"}
+        if self.limiter is not None and not self.limiter.try_acquire():
+            self._release(hedge_key)
+            return primary.result(), key
+        METRICS.count("hedged_requests")
+        hedge = self._submit_send(url, json, hedge_headers, timeout, hedge_key)
+        keys = {primary: key, hedge: hedge_key}
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                        other.add_done_callback(_close_response)
+                    if future is hedge:
+                        METRICS.count("hedge_wins")
+                    return future.result(), keys[future]
+                error = future.exception()
+        raise error
+
+    def _delay(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.backoff * 2 ** attempt, self.backoff_max))
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        """POST с повторами; без явного timeout он берётся из наблюдаемых задержек."""
+        if self.breaker is not None:
+            # Разомкнутая цепь отказывает сразу, не ставя запрос в очередь лимитера
+            self.breaker.check()
+        return self._post(url, json, headers, timeout or self.latency_for(json).timeout())
+
+    def _attempt(self, url, json, headers, timeout, key=None):
+        """Одна отправка под предохранителем; возвращает (response, ключ ответа).
+
+        Ожидание лимитера и ключа (queue_wait_seconds) не входит ни в network,
+        ни в задержку, которую учитывает предохранитель. Аренда key переходит
+        к отправке и освобождается в любом случае.
+        """
+        if self.breaker is None:
+            with METRICS.span("network"):
+                return self._hedged_send(url, json, headers, timeout, key)
+
+        import requests
+
+        try:
+            probe = self.breaker.before_call()
+        except BaseException:
+            self._release(key)
+            raise
+        started = time.perf_counter()
+        try:
+            with METRICS.span("network"):
+                response, key = self._hedged_send(url, json, headers, timeout, key)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record(False, time.perf_counter() - started, probe)
+            raise
+        except BaseException:
+            self.breaker.release(probe)
+            raise
+        self.breaker.record(response.status_code < 500, time.perf_counter() - started, probe)
+        return response, key
+
+    def _post(self, url, json, headers, timeout):
+        import requests
+
+        attempt = 0
+        while True:
+            response = None
+            key = None
+            send_headers = headers
+            if self.limiter is not None:
+                self.limiter.acquire()
+            if not any(name.lower() == "authorization" for name in headers or {}):
+                key = self.credentials.acquire()
+                send_headers = {**(headers or {}), "authorization": f"Bearer {key.key}"}
+            try:
+                response, key = self._attempt(url, json, send_headers, timeout, key)
+            except requests.exceptions.ConnectionError:
+                if attempt >= self.retries:
+                    raise
+            else:
+                # Ключ выведен из ротации (значит, есть другие): сразу повторяем на другом.
+                # Последний ключ не выводится: 429 ждёт паузу лимитера, 401/403 возвращается
+                rotated = key is not None and self.credentials.report(key, response)
+                if response.status_code == 429 and self.limiter is not None and not rotated:
+                    # Квота исчерпана для всего процесса, а не только для этого запроса
+                    self.limiter.pause(self._delay(attempt, response))
+                if not (rotated or response.status_code in RETRY_STATUSES) or attempt >= self.retries:
+                    return response
+                if rotated:
+                    self.stats.retry()
+                    METRICS.count("http_retries")
+                    attempt += 1
+                    continue
+            self.stats.retry()
+            METRICS.count("http_retries")
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+
+
+@st.cache_resource
+def get_lcm_client(pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF, http2=HTTP2):
+    return LCMClient(pool_size=pool_size, retries=retries, backoff=backoff, http2=http2)
@@ -0,0 +1,201 @@
+"""Общий движок генерации для app.py, app2.py и app2_dark.py.
+
+Тяжёлые зависимости (requests, numpy, PIL, streamlit_drawable_canvas)
+импортируются при первом использовании, а не при старте скрипта.
+"""
+import functools
+import inspect
+import io
+
+import streamlit as st
+
+from circuit_breaker import CIRCUIT_BREAKER, CircuitOpen
+from credentials import NoHealthyKey
+from history import get_history
+from lcm_client import API_URL, get_lcm_client
+from metrics import METRICS, render_metrics_panel
+from profiling import render_profile_report
+from rate_limiter import RATE_LIMITER, QueueTimeout, RequestCancelled
+from result_cache import cached_generation, get_result_cache
+from scheduler import ApiUnavailable, GenerationError, wait_for_result
+from session_memory import render_session_memory
+from single_flight import SINGLE_FLIGHT
+from sketch_encoder import encode_image, split_data_url
+
+FAILURE_MESSAGE = "Failed to generate image. Please check the error messages above and try again."
+
+
+def st_canvas(**kwargs):
+    from streamlit_drawable_canvas import st_canvas as _st_canvas
+
+    return _st_canvas(**kwargs)
+
+
+@functools.lru_cache(maxsize=32)
+def background_image(width, height, bg_color):
+    """Фон холста; один объект на (размер, цвет), его никто не изменяет."""
+    from PIL import Image
+
+    return Image.new('RGB', (width, height), color=bg_color)
+
+
+def fragment(func):
+    """st.fragment, в старых версиях st.experimental_fragment, иначе обычная функция."""
+    decorator = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return decorator(func) if decorator is not None else func
+
+
+def rerun(fragment_only=False):
+    """st.rerun (или st.experimental_rerun); fragment_only перезапускает только текущий фрагмент."""
+    _rerun = getattr(st, "rerun", None) or st.experimental_rerun
+    if fragment_only and "scope" in inspect.signature(_rerun).parameters:
+        return _rerun(scope="fragment")
+    return _rerun()
+
+
+def request_lcm_image(image_data, prompt, width, height, style="CINEMATIC", strength=0.65,
+                      client=None, url=None, api_key=None):
+    """Один запрос к generations-lcm без кэша; ошибки поднимаются как GenerationError.
+
+    Без api_key ключ выбирает пул ключей клиента.
+    """
+    import requests
+
+    headers = {
+        "accept": "application/json",
+        "content-type": "application/json",
+    }
+    if api_key:
+        headers["authorization"] = f"Bearer {api_key}"
+    payload = {
+        "width": width,
+        "height": height,
+        "imageDataUrl": image_data,
+        "prompt": prompt,
+        "style": style,
+        "strength": strength
+    }
+    try:
+        response = (client or get_lcm_client()).post(url or API_URL, json=payload, headers=headers)
+        response.raise_for_status()
+        with METRICS.span("parse"):
+            result = response.json()
+            return result['lcmGenerationJob']['imageDataUrl'][0]
+    except requests.exceptions.Timeout:
+        raise GenerationError("The request to the API timed out. Please try again later.")
+    except requests.exceptions.ConnectionError as e:
+        raise GenerationError(f"A connection error occurred: {e}")
+    except requests.exceptions.RequestException as e:
+        messages = [f"An error occurred while making the request: {e}"]
+        if hasattr(e, 'response') and e.response is not None:
+            messages.append(f"Response status code: {e.response.status_code}")
+            messages.append(f"Response content: {e.response.text}")
+        raise GenerationError(*messages)
+    except CircuitOpen as e:
+        raise ApiUnavailable(f"The image API is unavailable right now. Retrying in {e.retry_in:.0f}s.")
+    except NoHealthyKey as e:
+        if e.status == 429:
+            raise GenerationError(f"All API keys are rate limited. Please try again in {e.retry_in:.0f}s.")
+        raise GenerationError("The API rejected all configured API keys. Please check the API keys.")
+    except QueueTimeout:
+        raise GenerationError("The API is busy right now. Please try again in a moment.")
+    except RequestCancelled:
+        raise GenerationError("The request was superseded by a newer one.")
+    except KeyError:
+        raise GenerationError("Unexpected response format from the API.")
+    except Exception as e:
+        raise GenerationError(f"An unexpected error occurred: {e}")
+
+
+@cached_generation
+def generate_lcm_image(image_data, prompt, width, height, style="CINEMATIC", strength=0.65):
+    return request_lcm_image(image_data, prompt, width, height, style, strength)
+
+
+def decode_result(value):
+    """Декодирует результат в PIL - нужно только для постобработки."""
+    from PIL import Image
+
+    with METRICS.span("decode"):
+        image = Image.open(io.BytesIO(split_data_url(value)[1]))
+        image.load()
+    return image
+
+
+def show_result(result, image_placeholder, width, report_errors=True, failure_message=FAILURE_MESSAGE,
+                postprocess=None, fallback=None):
+    """Показывает результат.
+
+    Без postprocess байты уходят в браузер в исходном формате, без декодирования
+    и перекодирования в PNG на сервере. Если API недоступно, вместо стопки
+    ошибок показывается fallback (последняя удачная запись истории).
+    """
+    if isinstance(result.error, ApiUnavailable):
+        if fallback is not None:
+            image_placeholder.image(fallback.image_bytes, caption=f"Last result: {fallback.caption}", width=width)
+        if report_errors:
+            st.warning(result.error.args[0])
+    elif result.value:
+        caption = "Generated Image" if result.final else "Preview (refining...)"
+        if postprocess is not None:
+            image = postprocess(decode_result(result.value))
+        else:
+            with METRICS.span("decode"):
+                image = split_data_url(result.value)[1]
+        with METRICS.span("render"):
+            image_placeholder.image(image, caption=caption, use_column_width=False, width=width)
+    elif report_errors:
+        if isinstance(result.error, GenerationError):
+            for message in result.error.args:
+                st.error(message)
+        elif result.error is not None:
+            st.error(f"An unexpected error occurred: {result.error}")
+        image_placeholder.error(failure_message)
+
+
+def display_generation(scheduler, image_placeholder, status_placeholder, width,
+                       spinner_text="Generating image...", failure_message=FAILURE_MESSAGE, postprocess=None):
+    """Показывает последний результат и, если он устарел, ждёт более свежий."""
+    history = get_history()
+
+    def show(result, report_errors=True):
+        fallback = history.entries[-1] if history.entries else None
+        show_result(result, image_placeholder, width, report_errors, failure_message, postprocess, fallback)
+
+    seq = scheduler.outstanding()
+    latest = scheduler.latest_result()
+    if latest is not None:
+        history.add(latest)
+        show(latest, report_errors=False)
+    if seq is not None:
+        with st.spinner(spinner_text):
+            result = wait_for_result(scheduler, seq, status_placeholder, on_preview=show)
+        if result is not None:
+            history.add(result)
+            show(result)
+
+
+def render_engine_status(prefetch=False):
+    """Состояние общих компонентов в боковой панели: пул, кэш, очередь, ключи, предохранитель."""
+    client = get_lcm_client()
+    pool_stats = client.stats.snapshot()
+    st.caption(f"HTTP pool: {pool_stats['hits']} hits / {pool_stats['misses']} misses, {pool_stats['retries']} retries")
+    cache_stats = get_result_cache().stats()
+    st.caption(f"Result cache: {cache_stats['hit_rate']:.0%} hit rate ({cache_stats['memory_hits']} memory / {cache_stats['disk_hits']} disk / {cache_stats['misses']} misses)")
+    flight_stats = SINGLE_FLIGHT.stats()
+    st.caption(f"Single-flight: {flight_stats['collapsed']} requests joined an in-flight call")
+    if prefetch:
+        st.caption(f"Prefetch: {cache_stats['prefetch_hits']} of {cache_stats['prefetch_stored']} prefetched results used ({cache_stats['prefetch_hit_ratio']:.0%})")
+    queue_stats = RATE_LIMITER.stats()
+    st.caption(f"API queue: {queue_stats['depth']} waiting, avg wait {queue_stats['avg_wait']:.2f}s")
+    key_stats = client.credential_stats()
+    if key_stats:
+        healthy = sum(1 for key in key_stats if not key['ejected_for'])
+        st.caption(f"API keys: {healthy} of {len(key_stats)} healthy, {sum(key['in_flight'] for key in key_stats)} in flight")
+    breaker_stats = CIRCUIT_BREAKER.stats()
+    st.caption(f"API circuit: {breaker_stats['state']}, {breaker_stats['rejected']} fast-failed calls")
+    if st.checkbox("Show performance metrics"):
+        render_metrics_panel()
+    if st.checkbox("Show session memory"):
+        render_session_memory()
+    render_profile_report()
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Сколько последних замеров хранить на метрику для перцентилей
+WINDOW = int(os.environ.get("LCM_METRICS_WINDOW", "2048"))
+# Если задан, каждый замер дописывается в этот файл строкой JSON
+EVENTS_PATH = os.environ.get("LCM_METRICS_JSONL")
+PORT = int(os.environ.get("LCM_METRICS_PORT", "0"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """Метрики процесса (общие для всех сессий): сводки со скользящим окном и счётчики."""
+
+    def __init__(self, window=WINDOW, events_path=EVENTS_PATH):
+        self._lock = threading.Lock()
+        self._window = window
+        self._events_path = events_path
+        self._samples = defaultdict(lambda: deque(maxlen=self._window))
+        self._totals = defaultdict(lambda: [0, 0.0])
+        self._counters = defaultdict(int)
+
+    def observe(self, name, value, stage=None):
+        key = (name, stage)
+        with self._lock:
+            self._samples[key].append(value)
+            total = self._totals[key]
+            total[0] += 1
+            total[1] += value
+            if self._events_path:
+                event = {"ts": time.time(), "metric": name, "value": value}
+                if stage is not None:
+                    event["stage"] = stage
+                with open(self._events_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event) + "\n")
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage)
+
+    def summaries(self):
+        with self._lock:
+            items = [(key, sorted(samples), tuple(self._totals[key])) for key, samples in self._samples.items()]
+        result = []
+        for (name, stage), ordered, (count, total) in sorted(items, key=lambda item: (item[0][0], item[0][1] or "")):
+            result.append({
+                "metric": name,
+                "stage": stage,
+                "count": count,
+                "sum": total,
+                **{f"p{int(q * 100)}": percentile(ordered, q) for q in QUANTILES},
+            })
+        return result
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        for summary in self.summaries():
+            name = f"lcm_{summary['metric']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            labels = f'stage="{summary["stage"]}",' if summary["stage"] is not None else ""
+            for q in QUANTILES:
+                lines.append(f'{name}{{{labels}quantile="{q}"}} {summary[f"p{int(q * 100)}"]}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{name}_count{suffix} {summary['count']}")
+            lines.append(f"{name}_sum{suffix} {summary['sum']}")
+        for name, value in sorted(self.counters().items()):
+            lines.append(f"# TYPE lcm_{name}_total counter")
+            lines.append(f"lcm_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        ts = time.time()
+        lines = [json.dumps({"ts": ts, **summary}) for summary in self.summaries()]
+        lines += [json.dumps({"ts": ts, "counter": name, "value": value})
+                  for name, value in sorted(self.counters().items())]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def _metrics_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = METRICS.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.jsonl":
+                body, content_type = METRICS.to_json_lines(), "application/x-ndjson"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return _MetricsHandler
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=PORT, host="0.0.0.0"):
+    """Один раз на процесс поднимает /metrics (Prometheus) и /metrics.jsonl; port=0 - не запускать."""
+    global _server
+    if not port:
+        return None
+    from http.server import ThreadingHTTPServer
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _metrics_handler())
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def render_metrics_panel():
+    import streamlit as st
+
+    rows = [
+        {
+            "stage": summary["stage"] or summary["metric"],
+            "count": summary["count"],
+            **{f"p{int(q * 100)}": summary[f"p{int(q * 100)}"] for q in QUANTILES},
+        }
+        for summary in METRICS.summaries()
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+    else:
+        st.caption("No measurements yet.")
+    counters = METRICS.counters()
+    if counters:
+        st.caption(", ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+    st.download_button("Prometheus metrics", METRICS.to_prometheus(), file_name="lcm_metrics.prom")
+    st.download_button("JSON lines", METRICS.to_json_lines(), file_name="lcm_metrics.jsonl")
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from executors import get_prefetch_pool
+from metrics import METRICS
+from rate_limiter import PREFETCH, request_context
+from result_cache import get_result_cache
+
+# Сколько секунд холст должен простоять, прежде чем начнётся префетч
+IDLE = float(os.environ.get("LCM_PREFETCH_IDLE", "2"))
+# Бюджет сессии: не больше BUDGET запросов за WINDOW секунд
+BUDGET = int(os.environ.get("LCM_PREFETCH_BUDGET", "12"))
+WINDOW = float(os.environ.get("LCM_PREFETCH_WINDOW", "600"))
+STRENGTH_STEP = 0.05
+STRENGTH_NEIGHBORS = int(os.environ.get("LCM_PREFETCH_STRENGTHS", "2"))
+TOP_STYLES = int(os.environ.get("LCM_PREFETCH_STYLES", "2"))
+
+# Популярность стилей по всему процессу
+_style_usage = Counter()
+_style_lock = threading.Lock()
+
+
+def popular_styles(n, exclude=None, allowed=None):
+    with _style_lock:
+        ranked = [style for style, _ in _style_usage.most_common()]
+    return [s for s in ranked if s != exclude and (allowed is None or s in allowed)][:n]
+
+
+def candidates(snapshot, styles=None):
+    """Соседние шаги strength, затем самые частые стили при текущей strength."""
+    image_data, prompt, width, height, style, strength = snapshot
+    result = []
+    for distance in range(1, STRENGTH_NEIGHBORS + 1):
+        for sign in (-1, 1):
+            neighbor = round(strength + sign * distance * STRENGTH_STEP, 2)
+            if 0.0 <= neighbor <= 1.0:
+                result.append((image_data, prompt, width, height, style, neighbor))
+    for other in popular_styles(TOP_STYLES, exclude=style, allowed=styles):
+        result.append((image_data, prompt, width, height, other, strength))
+    return result
+
+
+class Prefetcher:
+    """Префетч одной сессии: после простоя холста догенерирует соседние настройки в кэш.
+
+    Запросы идут с приоритетом PREFETCH в отдельном пуле get_prefetch_pool()
+    и отменяются, как только пользователь рисует дальше (меняется seq планировщика).
+    """
+
+    def __init__(self, budget=BUDGET, window=WINDOW, idle=IDLE):
+        self.budget = budget
+        self.window = window
+        self.idle = idle
+        self._lock = threading.Lock()
+        self._spent = deque()
+        self._seq = None
+        self._snapshot = None
+        self._started_for = None
+        self.issued = 0
+
+    def track(self, seq, snapshot):
+        """Запоминает последний отправленный снимок (эскиз может быть Future)."""
+        with _style_lock:
+            _style_usage[snapshot[4]] += 1
+        with self._lock:
+            self._seq = seq
+            self._snapshot = snapshot
+
+    def memory_footprint(self):
+        with self._lock:
+            image_data = self._snapshot[0] if self._snapshot else None
+            return len(image_data) if isinstance(image_data, str) else 0
+
+    def _take_budget(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._spent and now - self._spent[0] > self.window:
+                self._spent.popleft()
+            if len(self._spent) >= self.budget:
+                return False
+            self._spent.append(now)
+            self.issued += 1
+            return True
+
+    def start(self, scheduler, generate, styles=None):
+        """Запускает префетч для последнего снимка, если его результат уже показан."""
+        with self._lock:
+            seq, snapshot = self._seq, self._snapshot
+            if snapshot is None or seq == self._started_for:
+                return
+            if scheduler.outstanding() is not None or not scheduler.is_current(seq):
+                return
+            self._started_for = seq
+        get_prefetch_pool().submit(self._run, scheduler, generate, seq, snapshot, styles, get_script_run_ctx())
+
+    def _run(self, scheduler, generate, seq, snapshot, styles, ctx):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+        def stale():
+            return not scheduler.is_current(seq)
+
+        deadline = time.monotonic() + self.idle
+        while time.monotonic() < deadline:
+            if stale():
+                return
+            time.sleep(0.1)
+
+        image_data = snapshot[0]
+        if isinstance(image_data, Future):
+            image_data = image_data.result()
+        cache = get_result_cache()
+        for candidate in candidates((image_data,) + tuple(snapshot[1:]), styles):
+            if stale():
+                return
+            if cache.key(*candidate) in cache:
+                continue
+            if not self._take_budget():
+                return
+            METRICS.count("prefetch_issued")
+            try:
+                with request_context(PREFETCH, stale):
+                    generate(*candidate)
+            except Exception:
+                # Ошибки префетча пользователю не показываются
+                METRICS.count("prefetch_errors")
+
+
+def get_prefetcher():
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = Prefetcher()
+    return st.session_state.prefetcher
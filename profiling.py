@@ -0,0 +1,274 @@
+"""Профилирование одного перезапуска по запросу администратора.
+
+Открыть страницу с ?profile=<LCM_PROFILE_TOKEN>[&profile_mode=sampling|cprofile]:
+следующий перезапуск (полный или только фрагмента холста) будет профилирован,
+а отчёт появится в боковой панели. Без LCM_PROFILE_TOKEN функция выключена.
+
+cprofile - детерминированный профиль потока скрипта (файл pstats).
+sampling - выборки стеков потока скрипта и потоков lcm-* этой сессии (планировщик,
+префетч, варианты) каждые LCM_PROFILE_INTERVAL_MS; отдаётся как collapsed stacks и
+SVG flamegraph. Потоки других сессий не попадают; дубликаты хеджирования идут без
+контекста сессии и тоже не попадают.
+"""
+import functools
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from html import escape
+
+import streamlit as st
+
+TOKEN = os.environ.get("LCM_PROFILE_TOKEN", "")
+INTERVAL = float(os.environ.get("LCM_PROFILE_INTERVAL_MS", "5")) / 1000
+TOP_N = int(os.environ.get("LCM_PROFILE_TOP", "25"))
+MODES = ("cprofile", "sampling")
+
+_active = threading.local()
+
+try:
+    from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+except ImportError:
+    SCRIPT_RUN_CONTEXT_ATTR_NAME = "streamlit_script_run_ctx"
+
+
+def _query_params():
+    if hasattr(st, "query_params"):
+        return dict(st.query_params)
+    return {name: values[-1] for name, values in st.experimental_get_query_params().items() if values}
+
+
+def _clear_query_params(*names):
+    if hasattr(st, "query_params"):
+        for name in names:
+            if name in st.query_params:
+                del st.query_params[name]
+    else:
+        params = st.experimental_get_query_params()
+        st.experimental_set_query_params(**{k: v for k, v in params.items() if k not in names})
+
+
+def _arm_from_query():
+    """Взводит профилирование следующего перезапуска, если в URL верный токен."""
+    params = _query_params()
+    token = params.get("profile")
+    if not TOKEN or token is None:
+        return
+    _clear_query_params("profile", "profile_mode")
+    if not hmac.compare_digest(token, TOKEN):
+        return
+    mode = params.get("profile_mode", "cprofile")
+    st.session_state['_profile_next'] = mode if mode in MODES else "cprofile"
+
+
+def _session_of(thread):
+    """session_id из контекста, который add_script_run_ctx навесил на поток пула."""
+    return getattr(getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None), "session_id", None)
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Выборочный профайлер: снимает стеки потоков thread_ids и потоков lcm-* сессии session_id."""
+
+    def __init__(self, thread_ids, session_id=None, interval=INTERVAL):
+        self.thread_ids = set(thread_ids)
+        self.session_id = session_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _tracked(self):
+        names = {}
+        for thread in threading.enumerate():
+            if thread.ident in self.thread_ids or (
+                self.session_id is not None
+                and thread.name.startswith("lcm-")
+                and _session_of(thread) == self.session_id
+            ):
+                names[thread.ident] = thread.name
+        return names
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = self._tracked()
+            for ident, frame in sys._current_frames().items():
+                if ident not in names:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                # Свободный поток пула ждёт задачу в queue.get - его не считаем
+                if len(stack) > 1 and stack[1].startswith("get (queue.py"):
+                    continue
+                self.stacks[";".join([names[ident]] + stack[::-1])] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, n=TOP_N):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        seconds = self.interval
+        return [
+            {"function": name, "self_s": round(own[name] * seconds, 4), "total_s": round(count * seconds, 4),
+             "samples": count}
+            for name, count in total.most_common(n)
+        ]
+
+
+def flamegraph_svg(stacks, width=1200, row=16):
+    """Простой SVG flamegraph из collapsed stacks (корень снизу)."""
+    root = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+
+    rects = []
+    depth_max = [0]
+
+    def walk(node, x, depth):
+        depth_max[0] = max(depth_max[0], depth)
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] / root["count"] * width if root["count"] else 0
+            if w >= 0.5:
+                rects.append((x, depth, w, name, child["count"]))
+                walk(child, x, depth + 1)
+            x += w
+
+    walk(root, 0.0, 0)
+    height = (depth_max[0] + 1) * row
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">']
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * row
+        hue = 20 + hash(name) % 40
+        label = escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},80%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + row - 4}">{label[:int(w / 7)]}</text></g>'
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def _cprofile_report(profile, elapsed):
+    import marshal
+    import pstats
+
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in sorted(
+        stats.stats.items(), key=lambda item: -item[1][3]
+    )[:TOP_N]:
+        rows.append({
+            "function": f"{name} ({os.path.basename(filename)}:{line})",
+            "calls": ncalls,
+            "self_s": round(tottime, 4),
+            "total_s": round(cumtime, 4),
+        })
+    # Тот же формат, что пишет Stats.dump_stats, но без временного файла
+    return {"mode": "cprofile", "elapsed": elapsed, "top": rows,
+            "files": {"rerun.pstats": marshal.dumps(stats.stats)}}
+
+
+def _run_profiled(mode, func, args, kwargs):
+    started = time.perf_counter()
+    if mode == "sampling":
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        sampler = Sampler([threading.get_ident()], ctx.session_id if ctx is not None else None)
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            st.session_state['_profile_report'] = {
+                "mode": "sampling",
+                "elapsed": time.perf_counter() - started,
+                "top": sampler.top(),
+                "files": {
+                    "rerun.collapsed.txt": sampler.collapsed().encode("utf-8"),
+                    "rerun.flamegraph.svg": flamegraph_svg(sampler.stacks).encode("utf-8"),
+                },
+            }
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        st.session_state['_profile_report'] = _cprofile_report(profile, time.perf_counter() - started)
+
+
+def profiled(func=None, *, refresh=False):
+    """Оборачивает main() или фрагмент: профилирует вызов, если перезапуск взведён.
+
+    refresh=True для фрагментов: после профилирования запускается полный
+    перезапуск, чтобы отчёт появился в боковой панели.
+    """
+    if func is None:
+        return functools.partial(profiled, refresh=refresh)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_active, "on", False):
+            return func(*args, **kwargs)
+        _active.on = True
+        mode = st.session_state.pop('_profile_next', None)
+        try:
+            if mode is None:
+                return func(*args, **kwargs)
+            return _run_profiled(mode, func, args, kwargs)
+        finally:
+            _active.on = False
+            _arm_from_query()
+            if mode is not None and refresh:
+                from lcm_engine import rerun
+
+                rerun()
+    return wrapper
+
+
+def render_profile_report():
+    """Отчёт последнего профилирования в боковой панели (только если он есть)."""
+    if '_profile_next' in st.session_state:
+        st.caption(f"Profiling armed ({st.session_state['_profile_next']}): the next rerun will be profiled.")
+    report = st.session_state.get('_profile_report')
+    if report is None:
+        return
+    with st.expander(f"Profile: {report['mode']}, {report['elapsed'] * 1000:.0f} ms", expanded=True):
+        if report["mode"] == "sampling":
+            st.caption("Only this session's script and pool threads are sampled; hedged duplicates are not.")
+        st.dataframe(report["top"], use_container_width=True)
+        for name, data in report["files"].items():
+            st.download_button(name, data, file_name=name, key=f"profile_{name}")
+        if st.button("Discard profile"):
+            del st.session_state['_profile_report']
@@ -0,0 +1,185 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+# Квота процесса на запросы к API: RATE запросов в секунду, всплеск до BURST
+RATE = float(os.environ.get("LCM_RATE_LIMIT", "5"))
+BURST = float(os.environ.get("LCM_RATE_BURST", "10"))
+QUEUE_TIMEOUT = float(os.environ.get("LCM_QUEUE_TIMEOUT", "30"))
+
+# Чем меньше число, тем раньше запрос выходит из очереди
+INTERACTIVE = 0
+BACKGROUND = 1
+PREFETCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", PREFETCH: "prefetch"}
+
+_context = contextvars.ContextVar("lcm_request_context", default=(INTERACTIVE, None))
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+@contextmanager
+def request_context(priority=INTERACTIVE, cancelled=None):
+    """Задаёт приоритет (и проверку отмены) для запросов из текущего потока."""
+    token = _context.set((priority, cancelled))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_priority():
+    return _context.get()[0]
+
+
+def is_cancelled():
+    """Отменён ли запрос текущего потока (например, вытеснен более новым)."""
+    _, cancelled = _context.get()
+    return cancelled is not None and cancelled()
+
+
+def current_session():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+class _Waiter:
+    def __init__(self, priority, session, cancelled):
+        self.priority = priority
+        self.session = session
+        self.cancelled = cancelled
+        self.enqueued = time.monotonic()
+
+
+class RateLimiter:
+    """Token bucket на процесс с очередью по приоритету.
+
+    Внутри одного приоритета первым идёт запрос сессии, которую обслуживали
+    дольше всего назад, поэтому одна активная сессия не вытесняет остальные.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = []
+        self._last_served = {}
+        self._waits = deque(maxlen=256)
+        self.granted = 0
+
+    def _refill(self, now):
+        if now < self._paused_until:
+            self._updated = now
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _head(self):
+        return min(
+            self._queue,
+            key=lambda w: (w.priority, self._last_served.get(w.session, 0.0), w.enqueued),
+        )
+
+    def acquire(self, timeout=QUEUE_TIMEOUT):
+        """Ждёт разрешения на один запрос; возвращает время ожидания в секундах."""
+        if self.rate <= 0:
+            return 0.0
+        priority, cancelled = _context.get()
+        waiter = _Waiter(priority, current_session(), cancelled)
+        deadline = waiter.enqueued + timeout
+        with self._cond:
+            self._queue.append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if waiter.cancelled is not None and waiter.cancelled():
+                        raise RequestCancelled()
+                    if now >= deadline:
+                        raise QueueTimeout(f"waited {timeout:.0f}s for an API slot")
+                    self._refill(now)
+                    if self._head() is waiter and now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        self._last_served[waiter.session] = now
+                        if len(self._last_served) > 1024:
+                            self._forget_idle_sessions(now)
+                        self.granted += 1
+                        waited = now - waiter.enqueued
+                        self._waits.append(waited)
+                        METRICS.observe("queue_wait_seconds", waited, PRIORITY_NAMES.get(priority))
+                        return waited
+                    if self._head() is waiter:
+                        delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                    else:
+                        delay = 0.1
+                    # Просыпаемся не реже раза в 100 мс, чтобы заметить отмену
+                    self._cond.wait(min(delay, deadline - now, 0.1))
+            finally:
+                self._queue.remove(waiter)
+                self._cond.notify_all()
+
+    def try_acquire(self):
+        """Берёт токен без ожидания, только если очередь пуста; иначе False."""
+        if self.rate <= 0:
+            return True
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if self._queue or now < self._paused_until or self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.granted += 1
+            return True
+
+    def _forget_idle_sessions(self, now, idle=600):
+        for session, served in list(self._last_served.items()):
+            if now - served > idle:
+                del self._last_served[session]
+
+    def set_rate(self, rate, burst=None):
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if burst is not None:
+                self.burst = max(burst, 1)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Останавливает выдачу разрешений, например после 429 с Retry-After."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            waits = list(self._waits)
+            return {
+                "depth": len(self._queue),
+                "depth_by_priority": {
+                    name: sum(1 for w in self._queue if w.priority == priority)
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+                "oldest_wait": max((now - w.enqueued for w in self._queue), default=0.0),
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "granted": self.granted,
+            }
+
+
+RATE_LIMITER = RateLimiter()
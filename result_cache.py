@@ -0,0 +1,252 @@
+import base64
+import functools
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from metrics import METRICS
+from rate_limiter import PREFETCH, current_priority
+from single_flight import SINGLE_FLIGHT
+
+CACHE_DIR = os.environ.get("LCM_CACHE_DIR", ".lcm_cache")
+MEMORY_BYTES = int(float(os.environ.get("LCM_CACHE_MEMORY_MB", "64")) * 1024 * 1024)
+DISK_BYTES = int(float(os.environ.get("LCM_CACHE_DISK_MB", "512")) * 1024 * 1024)
+TTL = float(os.environ.get("LCM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Эскиз уменьшается до HASH_SIZE x HASH_SIZE (RGB) и квантуется в HASH_LEVELS уровней:
+# мелкие различия растра (сглаживание, отдельные пиксели) обычно не меняют ключ, а новый
+# штрих меняет. Разницу кодеков хэш не гасит: тот же холст в JPEG q75, q85 или WebP даёт
+# разные ключи. Настройки кодера общие на процесс, поэтому для одного холста ключ стабилен.
+HASH_SIZE = int(os.environ.get("LCM_CACHE_HASH_SIZE", "64"))
+HASH_LEVELS = int(os.environ.get("LCM_CACHE_HASH_LEVELS", "16"))
+
+
+@functools.lru_cache(maxsize=32)
+def sketch_hash(image_data, size=HASH_SIZE, levels=HASH_LEVELS):
+    """Перцептивный хэш эскиза, переданного как data URL или base64.
+
+    Запоминается для последних эскизов: сетка вариантов и префетч спрашивают
+    ключи одного эскиза много раз, а декодировать его нужно один раз.
+    """
+    import numpy as np
+    from PIL import Image
+
+    if image_data.startswith("data:"):
+        image_data = image_data.split(',', 1)[1]
+    img = Image.open(io.BytesIO(base64.b64decode(image_data)))
+    # Для JPEG draft() декодирует сразу в уменьшенном масштабе.
+    # Хэшируется RGB, а не яркость: перекрашенный эскиз той же формы - другой ключ
+    img.draft('RGB', (size * 2, size * 2))
+    img = img.convert('RGB').resize((size, size), Image.BOX)
+    quantized = (np.asarray(img, dtype=np.uint16) * levels // 256).astype(np.uint8)
+    return hashlib.sha256(quantized.tobytes()).hexdigest()
+
+
+class ResultCache:
+    """Двухуровневый кэш результатов: LRU в памяти поверх каталога на диске.
+
+    Оба уровня ограничены по байтам и по TTL; значения - data URL из ответа API.
+    """
+
+    def __init__(self, directory=CACHE_DIR, memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES, ttl=TTL):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Ключи, положенные префетчем и ещё не запрошенные пользователем
+        self._prefetched = OrderedDict()
+        self.prefetch_stored = 0
+        self.prefetch_hits = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def key(self, image_data, prompt, width, height, style, strength):
+        parts = [sketch_hash(image_data), prompt, style, f"{float(strength):.3f}", f"{width}x{height}"]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self._disk[name] = (size, mtime)
+            self._disk_size += size
+        self._evict_disk()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, stored_at = self._memory[key]
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    METRICS.count("cache_memory_hits")
+                    return value
+                self._drop_memory(key)
+            entry = self._disk.get(key)
+
+        # Файл читается вне блокировки: другие сессии не ждут чужой ввод-вывод
+        value = None
+        if entry is not None and now - entry[1] <= self.ttl:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    value = f.read()
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            if value is not None:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._put_memory(key, value, entry[1])
+                self.disk_hits += 1
+                METRICS.count("cache_disk_hits")
+                return value
+            if entry is not None and self._disk.get(key) == entry:
+                self._drop_disk(key)
+            self.misses += 1
+            METRICS.count("cache_misses")
+            return None
+
+    def __contains__(self, key):
+        """Есть ли ключ в кэше; в отличие от get() не трогает счётчики и порядок LRU."""
+        now = time.time()
+        with self._lock:
+            for level in (self._memory, self._disk):
+                if key in level and now - level[key][1] <= self.ttl:
+                    return True
+            return False
+
+    def mark_prefetched(self, key):
+        with self._lock:
+            self._prefetched[key] = None
+            self._prefetched.move_to_end(key)
+            if len(self._prefetched) > 4096:
+                self._prefetched.popitem(last=False)
+            self.prefetch_stored += 1
+        METRICS.count("prefetch_stored")
+
+    def claim_prefetched(self, key):
+        """Засчитывает попадание, если ключ был положен префетчем."""
+        with self._lock:
+            if key not in self._prefetched:
+                return False
+            del self._prefetched[key]
+            self.prefetch_hits += 1
+        METRICS.count("prefetch_hits")
+        return True
+
+    def put(self, key, value):
+        now = time.time()
+        data = value.encode("utf-8")
+        with self._lock:
+            self._put_memory(key, value, now)
+        if len(data) > self.disk_bytes:
+            return
+        # Запись на диск - вне блокировки; у каждого потока свой временный файл
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)[0]
+            self._disk[key] = (len(data), now)
+            self._disk_size += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key, value, stored_at):
+        if key in self._memory:
+            self._drop_memory(key)
+        if len(value) > self.memory_bytes:
+            return
+        self._memory[key] = (value, stored_at)
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            self._drop_memory(next(iter(self._memory)))
+            self.evictions += 1
+
+    def _drop_memory(self, key):
+        value, _ = self._memory.pop(key)
+        self._memory_size -= len(value)
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes:
+            self._drop_disk(next(iter(self._disk)))
+            self.evictions += 1
+
+    def _drop_disk(self, key):
+        size, _ = self._disk.pop(key)
+        self._disk_size -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "prefetch_stored": self.prefetch_stored,
+                "prefetch_hits": self.prefetch_hits,
+                "prefetch_hit_ratio": self.prefetch_hits / self.prefetch_stored if self.prefetch_stored else 0.0,
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+
+def cached_generation(func):
+    """Оборачивает generate_lcm_image кэшем результатов процесса.
+
+    Промахи по одному ключу, пришедшие одновременно, делят один запрос к API.
+    """
+    @functools.wraps(func)
+    def wrapper(image_data, prompt, width, height, style="CINEMATIC", strength=0.65):
+        cache = get_result_cache()
+        key = cache.key(image_data, prompt, width, height, style, strength)
+        value = cache.get(key)
+        if value is None:
+            value = SINGLE_FLIGHT.do(key, lambda: fetch(key, image_data, prompt, width, height, style, strength))
+        elif current_priority() != PREFETCH:
+            cache.claim_prefetched(key)
+        return value
+
+    def fetch(key, *args):
+        value = func(*args)
+        if value:
+            cache = get_result_cache()
+            cache.put(key, value)
+            if current_priority() == PREFETCH:
+                cache.mark_prefetched(key)
+        return value
+    return wrapper
@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from executors import get_io_pool
+from metrics import METRICS
+from rate_limiter import INTERACTIVE, request_context
+
+DEFAULT_DEBOUNCE = float(os.environ.get("LCM_DEBOUNCE_MS", "300")) / 1000
+# Размер превью: длинная сторона PREVIEW_SIDE, но не меньше PREVIEW_MIN_SIDE
+# по короткой (минимальный размер, который принимает API)
+PREVIEW_SIDE = int(os.environ.get("LCM_PREVIEW_SIDE", "512"))
+PREVIEW_MIN_SIDE = int(os.environ.get("LCM_PREVIEW_MIN_SIDE", "512"))
+
+
+class GenerationError(Exception):
+    """Ошибка генерации; args - сообщения для показа пользователю."""
+
+
+class ApiUnavailable(GenerationError):
+    """API временно недоступно (разомкнут предохранитель); вызов не отправлялся."""
+
+
+class GenerationResult:
+    def __init__(self, seq, snapshot, value=None, error=None, final=True):
+        self.seq = seq
+        # Эскиз не нужен после генерации: храним только параметры
+        self.snapshot = (None,) + tuple(snapshot[1:])
+        self.value = value
+        self.error = error
+        self.final = final
+
+
+def preview_size(width, height, long_side=PREVIEW_SIDE, min_side=PREVIEW_MIN_SIDE):
+    scale = long_side / max(width, height)
+    scale = max(scale, min_side / min(width, height))
+    if scale >= 1:
+        return width, height
+    return int(width * scale) // 8 * 8, int(height * scale) // 8 * 8
+
+
+def progressive_stages(snapshot):
+    """Сначала превью в уменьшенном размере, затем полноразмерный запрос."""
+    image_data, prompt, width, height, style, strength = snapshot
+    preview_width, preview_height = preview_size(width, height)
+    if (preview_width, preview_height) == (width, height):
+        return [snapshot]
+    return [(image_data, prompt, preview_width, preview_height, style, strength), snapshot]
+
+
+class GenerationScheduler:
+    """Планировщик генераций одной сессии: выполняется только последний снимок.
+
+    Каждый submit() заменяет ожидающий снимок. Воркер ждёт окно debounce после
+    последнего изменения, а результат устаревшего запроса отбрасывается.
+    Если задан stages, снимок выполняется в несколько проходов, и следующий
+    проход не начинается, когда снимок уже устарел. Эскиз в снимке может быть
+    Future (см. executors.submit_encode); воркер дождётся его сам. Воркер
+    берёт поток из общего пула и возвращает его, когда снимков больше нет.
+    """
+
+    def __init__(self, generate, debounce=DEFAULT_DEBOUNCE, stages=None, executor=None):
+        self._generate = generate
+        self.debounce = debounce
+        self.stages = stages
+        self._executor = executor
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._pending = None
+        self._submitted_at = 0.0
+        self._result = None
+        self._worker = None
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+
+    def submit(self, snapshot):
+        with self._cond:
+            self._seq += 1
+            self.submitted += 1
+            if self._pending is not None:
+                self.dropped += 1
+                stale = self._pending[1][0]
+                if isinstance(stale, Future):
+                    # Кодирование заменённого эскиза ещё стоит в очереди пула - снимаем его
+                    stale.cancel()
+            self._pending = (self._seq, snapshot)
+            self._submitted_at = time.monotonic()
+            self._cond.notify_all()
+            if self._worker is None:
+                executor = self._executor or get_io_pool()
+                self._worker = executor.submit(self._run, get_script_run_ctx())
+            return self._seq
+
+    def is_current(self, seq):
+        with self._cond:
+            return seq == self._seq
+
+    def outstanding(self):
+        """Номер последнего снимка, если его итоговый результат ещё не готов."""
+        with self._cond:
+            result = self._result
+            if self._seq == 0 or (result is not None and result.seq == self._seq and result.final):
+                return None
+            return self._seq
+
+    def memory_footprint(self):
+        """Байты, которые планировщик держит в сессии: ожидающий эскиз и последний результат."""
+        with self._cond:
+            size = 0
+            if self._pending is not None and isinstance(self._pending[1][0], str):
+                size += len(self._pending[1][0])
+            if self._result is not None and self._result.value:
+                size += len(self._result.value)
+            return size
+
+    def latest_result(self):
+        with self._cond:
+            return self._result
+
+    def wait(self, seq, timeout, known=None):
+        """Ждёт новый (не known) результат для seq; None, если время вышло или seq устарел."""
+        def ready():
+            result = self._result
+            return result is not None and result.seq == seq and result is not known
+
+        with self._cond:
+            self._cond.wait_for(lambda: seq != self._seq or ready(), timeout)
+            return self._result if ready() else None
+
+    def _run(self, ctx=None):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        while True:
+            with self._cond:
+                if self._pending is None:
+                    self._worker = None
+                    return
+                delay = self._submitted_at + self.debounce - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                seq, snapshot = self._pending
+                self._pending = None
+                make_stages = self.stages
+
+            if isinstance(snapshot[0], Future):
+                try:
+                    snapshot = (snapshot[0].result(),) + tuple(snapshot[1:])
+                except Exception as e:
+                    METRICS.count("generation_errors")
+                    with self._cond:
+                        if seq == self._seq:
+                            self._result = GenerationResult(seq, snapshot, None, e)
+                            self.completed += 1
+                            self._cond.notify_all()
+                    continue
+            stages = make_stages(snapshot) if make_stages else [snapshot]
+
+            for stage, stage_snapshot in enumerate(stages):
+                final = stage == len(stages) - 1
+                value, error = None, None
+                try:
+                    with METRICS.span("generation"), request_context(INTERACTIVE, lambda: seq != self._seq):
+                        value = self._generate(*stage_snapshot)
+                except Exception as e:
+                    error = e
+                    METRICS.count("generation_errors")
+
+                with self._cond:
+                    if seq != self._seq:
+                        self.dropped += 1
+                        break
+                    if not final and not value:
+                        continue
+                    if final:
+                        self.completed += 1
+                    self._result = GenerationResult(seq, snapshot, value, error, final)
+                    self._cond.notify_all()
+
+
+def get_scheduler(generate, debounce=DEFAULT_DEBOUNCE, progressive=False):
+    if 'generation_scheduler' not in st.session_state:
+        st.session_state.generation_scheduler = GenerationScheduler(generate, debounce)
+    scheduler = st.session_state.generation_scheduler
+    scheduler.debounce = debounce
+    scheduler.stages = progressive_stages if progressive else None
+    return scheduler
+
+
+def wait_for_result(scheduler, seq, status_placeholder, on_preview=None, poll_interval=0.1):
+    """Ждёт итоговый результат, периодически обновляя статус.
+
+    Каждое обновление элемента даёт Streamlit прервать скрипт, если пришёл новый
+    штрих, поэтому ожидание устаревшего снимка не блокирует следующий rerun.
+    Промежуточные результаты (превью) передаются в on_preview.
+    """
+    started = time.monotonic()
+    preview = None
+    while True:
+        result = scheduler.wait(seq, poll_interval, known=preview)
+        if result is not None and result.final:
+            status_placeholder.empty()
+            return result
+        if result is not None:
+            preview = result
+            if on_preview is not None:
+                on_preview(result)
+        elif not scheduler.is_current(seq):
+            status_placeholder.empty()
+            return None
+        stage = "Refining" if preview is not None else "Generating"
+        status_placeholder.caption(f"{stage}... {time.monotonic() - started:.1f}s")
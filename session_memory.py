@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+import time
+
+import streamlit as st
+
+# Лимит на сессию; при превышении освобождается то, что умеет shrink() (история)
+SESSION_BYTES = int(float(os.environ.get("LCM_SESSION_MEMORY_MB", "16")) * 1024 * 1024)
+# Сессия без перезапусков дольше IDLE секунд выпадает из сводки
+IDLE = float(os.environ.get("LCM_SESSION_IDLE", "1800"))
+
+
+def footprint(value, _seen=None):
+    """Оценка памяти значения в байтах.
+
+    Объекты приложения сообщают размер сами через memory_footprint();
+    массивы NumPy - через nbytes; контейнеры обходятся рекурсивно.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if hasattr(value, "memory_footprint"):
+        return value.memory_footprint()
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int) and not isinstance(value, type):
+        return nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(footprint(k, _seen) + footprint(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(footprint(item, _seen) for item in value)
+    return size
+
+
+class SessionMemory:
+    """Сводка памяти session_state по сессиям процесса."""
+
+    def __init__(self, limit=SESSION_BYTES, idle=IDLE):
+        self.limit = limit
+        self.idle = idle
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.trimmed = 0
+
+    def account(self, session_id, state):
+        """Считает байты по ключам state, при превышении лимита ужимает; возвращает {ключ: байты}."""
+        by_key = {key: footprint(value) for key, value in state.items()}
+        total = sum(by_key.values())
+        if total > self.limit:
+            for key, value in sorted(state.items(), key=lambda item: -by_key[item[0]]):
+                if total <= self.limit:
+                    break
+                if hasattr(value, "shrink"):
+                    freed = value.shrink(total - self.limit)
+                    by_key[key] -= freed
+                    total -= freed
+                    with self._lock:
+                        self.trimmed += freed
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (total, now)
+            for sid, (_, seen) in list(self._sessions.items()):
+                if now - seen > self.idle:
+                    del self._sessions[sid]
+        return by_key
+
+    def sessions(self):
+        with self._lock:
+            return {sid: total for sid, (total, _) in self._sessions.items()}
+
+    def stats(self):
+        sessions = self.sessions()
+        total = sum(sessions.values())
+        return {
+            "sessions": len(sessions),
+            "total_bytes": total,
+            "avg_bytes": total / len(sessions) if sessions else 0.0,
+            "max_bytes": max(sessions.values(), default=0),
+            "limit_bytes": self.limit,
+            "trimmed_bytes": self.trimmed,
+        }
+
+
+SESSION_MEMORY = SessionMemory()
+
+
+def account_session():
+    """Вызывается в конце перезапуска: учитывает и при необходимости ужимает текущую сессию."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return {}
+    by_key = SESSION_MEMORY.account(ctx.session_id, st.session_state)
+    st.session_state['_session_memory'] = by_key
+    return by_key
+
+
+def render_session_memory():
+    """Диагностика: ключи текущей сессии и сводка по всем сессиям процесса."""
+    by_key = st.session_state.get('_session_memory', {})
+    rows = [{"key": key, "KB": round(size / 1024, 1)} for key, size in sorted(by_key.items(), key=lambda i: -i[1])]
+    st.caption(f"This session: {sum(by_key.values()) / 1024:.0f} KB")
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+    stats = SESSION_MEMORY.stats()
+    st.caption(
+        f"All sessions: {stats['sessions']} active, {stats['total_bytes'] / 1024 / 1024:.1f} MB total, "
+        f"avg {stats['avg_bytes'] / 1024:.0f} KB, max {stats['max_bytes'] / 1024:.0f} KB "
+        f"(cap {stats['limit_bytes'] / 1024 / 1024:.0f} MB, trimmed {stats['trimmed_bytes'] / 1024:.0f} KB)"
+    )
+    users = st.number_input("Estimate for concurrent users:", min_value=1, value=100, step=10)
+    per_session = stats["avg_bytes"] or sum(by_key.values())
+    st.caption(f"≈ {users * per_session / 1024 / 1024:.0f} MB of session state for {users} users")
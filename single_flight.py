@@ -0,0 +1,66 @@
+import threading
+
+from metrics import METRICS
+from rate_limiter import is_cancelled
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Склеивает одновременные одинаковые вызовы в один.
+
+    Первый вызов с ключом выполняет функцию, остальные ждут и получают его
+    результат или исключение. Если первый вызов был отменён как устаревший,
+    ожидающие не наследуют отмену и повторяют вызов сами.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.collapsed = 0
+
+    def do(self, key, func):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.leaders += 1
+            if leader:
+                return self._lead(key, call, func)
+            call.done.wait()
+            if not call.abandoned:
+                with self._lock:
+                    self.collapsed += 1
+                METRICS.count("singleflight_collapsed")
+                if call.error is not None:
+                    raise call.error
+                return call.value
+
+    def _lead(self, key, call, func):
+        try:
+            call.value = func()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            call.abandoned = is_cancelled()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "collapsed": self.collapsed}
+
+
+SINGLE_FLIGHT = SingleFlight()
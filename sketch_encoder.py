@@ -0,0 +1,83 @@
+import base64
+import binascii
+import io
+import logging
+import os
+import time
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+FORMAT = os.environ.get("LCM_SKETCH_FORMAT", "JPEG").upper()
+QUALITY = int(os.environ.get("LCM_SKETCH_QUALITY", "75"))
+# 0 - отправлять эскиз в размере холста
+MAX_SIDE = int(os.environ.get("LCM_SKETCH_MAX_SIDE", "0"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def hex_to_rgb(color):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def composite(image_data, bg_color):
+    """Накладывает RGBA холста на цвет фона за один проход NumPy."""
+    import numpy as np
+    from PIL import Image
+
+    rgba = np.asarray(image_data)
+    if rgba.dtype != np.uint8:
+        rgba = rgba.astype(np.uint8)
+    alpha = rgba[..., 3:4].astype(np.uint16)
+    bg = np.array(hex_to_rgb(bg_color), dtype=np.uint16)
+    rgb = (rgba[..., :3] * alpha + bg * (255 - alpha) + 127) // 255
+    return Image.fromarray(rgb.astype(np.uint8), 'RGB')
+
+
+def encode_image(image_data, bg_color="#ffffff", fmt=FORMAT, quality=QUALITY, max_side=MAX_SIDE):
+    """Кодирует холст в data URL для imageDataUrl."""
+    from PIL import Image
+
+    started = time.perf_counter()
+    img = composite(image_data, bg_color)
+    if max_side and max(img.size) > max_side:
+        scale = max_side / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    buffered = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(buffered, format="WEBP", quality=quality, method=0)
+    else:
+        fmt = "JPEG"
+        img.save(buffered, format="JPEG", quality=quality)
+    payload = buffered.getbuffer()
+    encoded = base64.b64encode(payload).decode('ascii')
+    elapsed = time.perf_counter() - started
+    METRICS.observe("stage_seconds", elapsed, "encode")
+    METRICS.observe("payload_bytes", len(encoded))
+    logger.info(
+        "sketch %dx%d encoded as %s q=%d: %d bytes (%d base64) in %.1f ms",
+        img.width, img.height, fmt, quality, payload.nbytes, len(encoded), elapsed * 1000,
+    )
+    return f"data:{MIME_TYPES[fmt]};base64,{encoded}"
+
+
+def encode_job(image_data, bg_color="#ffffff"):
+    """encode_image для пула процессов: время возвращается вместе с результатом."""
+    started = time.perf_counter()
+    value = encode_image(image_data, bg_color)
+    return value, time.perf_counter() - started
+
+
+def split_data_url(value):
+    """Возвращает (mime, bytes) из data URL.
+
+    a2b_base64 читает ASCII-строку напрямую, поэтому base64-часть копируется
+    один раз (срез), а не дважды, как при encode() и b64decode.
+    """
+    comma = value.index(',')
+    mime = value[len("data:"):comma].split(';')[0] or "image/jpeg"
+    return mime, binascii.a2b_base64(value[comma + 1:])
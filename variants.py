@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from rate_limiter import BACKGROUND, request_context
+from scheduler import GenerationError
+from sketch_encoder import split_data_url
+
+# Параллелизм одной сетки; общий лимит на процесс держит rate_limiter.
+# По умолчанию вся сетка 4 стиля x 3 силы уходит за один заход.
+MAX_CONCURRENCY = int(os.environ.get("LCM_VARIANT_CONCURRENCY", "12"))
+STRENGTH_OPTIONS = [0.2, 0.35, 0.5, 0.65, 0.8, 0.95]
+
+
+def generate_variants(generate, image_data, prompt, width, height, combos, max_workers=MAX_CONCURRENCY):
+    """Запускает все комбинации (style, strength) параллельно.
+
+    Отдаёт (index, value, error) по мере готовности ответов. Если скрипт
+    прерван, ещё не начатые запросы отменяются.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(combos), max_workers)),
+                                  thread_name_prefix="lcm-variant")
+    ctx = get_script_run_ctx()
+
+    def task(style, strength):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        with request_context(BACKGROUND):
+            return generate(image_data, prompt, width, height, style, strength)
+
+    futures = {
+        executor.submit(task, style, strength): i
+        for i, (style, strength) in enumerate(combos)
+    }
+    try:
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def render_variants(generate, image_data, prompt, width, height, styles, strengths):
+    combos = [(style, strength) for style in styles for strength in strengths]
+    if not combos:
+        st.info("Select at least one style and one strength for variants.")
+        return
+
+    cells = []
+    for style in styles:
+        columns = st.columns(len(strengths))
+        for column, strength in zip(columns, strengths):
+            cell = column.empty()
+            cell.caption(f"{style} · {strength:.2f} — waiting...")
+            cells.append(cell)
+
+    started = time.monotonic()
+    for i, value, error in generate_variants(generate, image_data, prompt, width, height, combos):
+        style, strength = combos[i]
+        caption = f"{style} · {strength:.2f}"
+        if value:
+            cells[i].image(split_data_url(value)[1], caption=caption, use_column_width=True)
+        elif isinstance(error, GenerationError):
+            cells[i].error(f"{caption}: {' '.join(error.args)}")
+        else:
+            cells[i].error(f"{caption}: {error or 'no image returned'}")
+    st.caption(f"{len(combos)} variants in {time.monotonic() - started:.1f}s")